@@ -1,11 +1,16 @@
-import dataclasses
 import datetime
+import json
 import logging
+import os
 import re
+import tempfile
+import time
 from dataclasses import dataclass, field
-from functools import partial
+from functools import lru_cache, partial
 from multiprocessing.dummy import Pool as ThreadPool
-from typing import Dict, List, Set
+from pathlib import Path
+from threading import BoundedSemaphore
+from typing import Dict, List, Optional, Set
 
 import yaml  # pylint: disable=wrong-import-order
 
@@ -20,6 +25,16 @@ from taskcat.regions_to_partitions import REGIONS
 
 LOG = logging.getLogger(__name__)
 
+# name patterns merged into the filter of a single describe_images call
+MAX_FILTER_VALUES = 50
+# describe_images calls in flight per region, to stay clear of API throttling
+MAX_REGION_REQUESTS = 4
+
+AMI_CACHE_PATH = Path("~/.taskcat_cache/ami_images.json").expanduser().resolve()
+AMI_CACHE_TTL = 24 * 60 * 60
+# only the image attributes used to pick and match AMIs are cached
+_CACHED_IMAGE_KEYS = ["ImageId", "Name", "CreationDate"]
+
 _REGIONS_JOINED = "|".join(REGIONS.keys())
 REGION_REGEX = re.compile(
     "(" + _REGIONS_JOINED + ")",
@@ -208,64 +223,303 @@ def build_codenames(tobj: Template, config: Config) -> List[RegionalCodename]:
     return built_cn
 
 
-def _per_codename_amifetch(region_dict, regional_cn):
-    new_filters = []
+class ImageCache:
+    """describe_images results kept on disk between runs.
+
+    Entries are keyed by account, region and the normalized filters of a codename,
+    so results are shared by every project using the same AMI filters. With
+    ``refresh`` cached entries are ignored, but fresh results are still stored."""
+
+    def __init__(
+        self,
+        path: Optional[Path] = AMI_CACHE_PATH,
+        ttl: int = AMI_CACHE_TTL,
+        refresh: bool = False,
+    ):
+        self._path = path
+        self._ttl = ttl
+        self._refresh = refresh
+        self._entries: Optional[Dict[str, dict]] = None
+
+    @property
+    def enabled(self):
+        return bool(self._path) and self._ttl > 0
+
+    @staticmethod
+    def _key(region_obj, regional_cn):
+        filters = sorted(
+            [_filter.Name, sorted(_filter.Values)] for _filter in regional_cn.filters
+        )
+        account_id = getattr(region_obj, "account_id", None)
+        return json.dumps([account_id, regional_cn.region, filters])
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self._path, "r", encoding="utf-8") as fh:
+                    entries = json.load(fh)
+            except (OSError, ValueError):
+                entries = {}
+            now = time.time()
+            self._entries = {
+                key: entry
+                for key, entry in (entries if isinstance(entries, dict) else {}).items()
+                if isinstance(entry, dict) and entry.get("expires", 0) >= now
+            }
+        return self._entries
+
+    def get(self, region_obj, regional_cn) -> Optional[List[dict]]:
+        if not self.enabled or self._refresh or region_obj is None:
+            return None
+        entry = self._load().get(self._key(region_obj, regional_cn))
+        return entry["images"] if entry else None
+
+    def set(self, region_obj, regional_cn, images):
+        if not self.enabled or region_obj is None:
+            return
+        self._load()[self._key(region_obj, regional_cn)] = {
+            "expires": int(time.time() + self._ttl),
+            "images": [
+                {k: image[k] for k in _CACHED_IMAGE_KEYS if k in image}
+                for image in images
+            ],
+        }
+
+    def save(self):
+        if not self.enabled or self._entries is None:
+            return
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            # write-then-rename, so concurrent taskcat processes never see a
+            # partially written file
+            with tempfile.NamedTemporaryFile(
+                "w", dir=self._path.parent, delete=False, encoding="utf-8"
+            ) as fh:
+                json.dump(self._entries, fh)
+            os.replace(fh.name, self._path)
+        except OSError as e:
+            LOG.debug(f"failed to write AMI cache {self._path}: {e}")
+
+
+@lru_cache(maxsize=None)
+def _name_pattern_regex(pattern):
+    # EC2 filter wildcards: "*" is any run of characters, "?" is exactly one, and a
+    # backslash escapes the next character
+    regex = []
+    chars = iter(pattern)
+    for char in chars:
+        if char == "\\":
+            regex.append(re.escape(next(chars, "\\")))
+        elif char == "*":
+            regex.append(".*")
+        elif char == "?":
+            regex.append(".")
+        else:
+            regex.append(re.escape(char))
+    return re.compile("".join(regex), re.DOTALL)
+
+
+@dataclass
+class _ImageQuery:
+    region: str
+    filters: Dict[str, List[str]]
+    members: List[RegionalCodename] = field(default_factory=list)
+    names: List[str] = field(default_factory=list)
+
+    def api_filters(self):
+        filters = [{"Name": k, "Values": v} for k, v in self.filters.items()]
+        if self.names:
+            filters.append({"Name": "name", "Values": self.names})
+        return filters
+
+    def demultiplex(self, images):
+        results = []
+        for regional_cn in self.members:
+            names = _codename_names(regional_cn)
+            if names is None:
+                matching = list(images)
+            else:
+                patterns = [_name_pattern_regex(name) for name in names]
+                matching = [
+                    image
+                    for image in images
+                    if any(p.fullmatch(image.get("Name", "")) for p in patterns)
+                ]
+            results.append(
+                {
+                    "region": regional_cn.region,
+                    "cn": regional_cn.cn,
+                    "api_results": matching,
+                }
+            )
+        return results
+
+
+def _codename_names(regional_cn):
     for _filter in regional_cn.filters:
-        new_filters.append(dataclasses.asdict(_filter))
-    _r = region_dict.get(regional_cn.region)
+        if _filter.Name == "name":
+            return list(_filter.Values)
+    return None
+
+
+def _batch_codenames(codename_list) -> List[_ImageQuery]:
+    """Groups regional codenames into as few describe_images queries as possible.
+
+    Codenames in a region whose filters only differ by name (typically the same
+    owner) share a query with the name patterns merged, results are matched back
+    to each codename by name."""
+
+    groups: Dict[tuple, List[RegionalCodename]] = {}
+    for regional_cn in sorted(codename_list, key=lambda x: (x.region, x.cn)):
+        shared = tuple(
+            sorted(
+                (_filter.Name, tuple(_filter.Values))
+                for _filter in regional_cn.filters
+                if _filter.Name != "name"
+            )
+        )
+        by_name = _codename_names(regional_cn) is not None
+        groups.setdefault((regional_cn.region, by_name, shared), []).append(regional_cn)
+
+    queries = []
+    for (region, by_name, shared), members in groups.items():
+        query = None
+        for regional_cn in members:
+            names = _codename_names(regional_cn) if by_name else []
+            new_names = [n for n in names if not query or n not in query.names]
+            if not query or len(query.names) + len(new_names) > MAX_FILTER_VALUES:
+                query = _ImageQuery(region, {k: list(v) for k, v in shared})
+                queries.append(query)
+                new_names = list(dict.fromkeys(names))
+            query.members.append(regional_cn)
+            query.names.extend(new_names)
+    return queries
+
+
+def _query_images(region_dict, semaphores, query):
+    _r = region_dict.get(query.region)
     image_results = []
     if _r:
-        image_results = _r.client("ec2").describe_images(Filters=new_filters)["Images"]
-    return {
-        "region": regional_cn.region,
-        "cn": regional_cn.cn,
-        "api_results": image_results,
-    }
+        with semaphores[query.region]:
+            image_results = _r.client("ec2").describe_images(
+                Filters=query.api_filters()
+            )["Images"]
+    return query.demultiplex(image_results)
 
 
 def query_codenames(
-    codename_list: Set[RegionalCodename], region_dict: Dict[str, RegionObj]
+    codename_list: Set[RegionalCodename],
+    region_dict: Dict[str, RegionObj],
+    image_cache: Optional[ImageCache] = None,
 ):
     """Fetches AMI IDs from AWS"""
 
+    return list(iter_query_codenames(codename_list, region_dict, image_cache))
+
+
+def iter_query_codenames(
+    codename_list: Set[RegionalCodename],
+    region_dict: Dict[str, RegionObj],
+    image_cache: Optional[ImageCache] = None,
+):
+    """Fetches AMI IDs from AWS, yielding each codename's results as they arrive"""
+
     if len(codename_list) == 0:
         raise AMIUpdaterFatalException(
             "No AMI filters were found. Nothing to fetch from the EC2 API."
         )
 
-    for region in list(region_dict.keys()):
-        _ = region_dict[region].client("ec2")
-
-    pool = ThreadPool(len(region_dict))
-    _p = partial(_per_codename_amifetch, region_dict)
-    response = pool.map(_p, codename_list)
-    return response
+    uncached = {}
+    cached = 0
+    for regional_cn in codename_list:
+        images = None
+        if image_cache:
+            images = image_cache.get(region_dict.get(regional_cn.region), regional_cn)
+        if images is None:
+            uncached[(regional_cn.region, regional_cn.cn)] = regional_cn
+            continue
+        cached += 1
+        yield {
+            "region": regional_cn.region,
+            "cn": regional_cn.cn,
+            "api_results": images,
+        }
+    if cached:
+        LOG.debug(f"Using cached describe_images results for {cached} codenames")
+    if not uncached:
+        return
+    for result in _query_codenames(set(uncached.values()), region_dict):
+        if image_cache:
+            regional_cn = uncached[(result["region"], result["cn"])]
+            image_cache.set(
+                region_dict.get(regional_cn.region), regional_cn, result["api_results"]
+            )
+        yield result
+    if image_cache:
+        image_cache.save()
+
+
+def _query_codenames(codename_list, region_dict):
+    queries = _batch_codenames(codename_list)
+    regions = {query.region for query in queries}
+    # clients are only built for regions that still need querying, in parallel
+    # because each one has to resolve credentials and endpoints
+    region_objs = [region_dict[region] for region in regions if region in region_dict]
+    if region_objs:
+        client_pool = ThreadPool(min(len(region_objs), 16))
+        client_pool.map(lambda region_obj: region_obj.client("ec2"), region_objs)
+        client_pool.close()
+    semaphores = {region: BoundedSemaphore(MAX_REGION_REQUESTS) for region in regions}
+
+    LOG.debug(
+        f"Querying {len(codename_list)} codenames with {len(queries)} "
+        f"describe_images calls"
+    )
+    pool = ThreadPool(min(len(queries), MAX_REGION_REQUESTS * len(regions), 32))
+    _p = partial(_query_images, region_dict, semaphores)
+    try:
+        for batch in pool.imap_unordered(_p, queries):
+            yield from batch
+    finally:
+        pool.terminate()
 
 
 def _image_timestamp(raw_ts):
-    return int(dateutil.parser.parse(raw_ts).timestamp())
+    # EC2 returns "2018-06-22T22:26:53.000Z", which fromisoformat parses far faster
+    # than dateutil once the "Z" is spelled as an offset
+    try:
+        if raw_ts.endswith("Z"):
+            raw_ts = raw_ts[:-1] + "+00:00"
+        return int(datetime.datetime.fromisoformat(raw_ts).timestamp())
+    except ValueError:
+        return int(dateutil.parser.parse(raw_ts).timestamp())
 
 
 def reduce_api_results(raw_results):
-    unsorted_results = []
+    """Returns the newest image for each region/codename, newest first.
+
+    raw_results may be any iterable, only the current newest image per
+    region/codename is kept while it is consumed."""
+
     missing_results = []
-    final_results = []
-    result_state = {}
+    latest: Dict[tuple, APIResultsData] = {}
 
     for query_result in raw_results:
-        if query_result["api_results"]:
-            cn_api_results_data = [
-                APIResultsData(
+        if not query_result["api_results"]:
+            missing_results.append(query_result)
+            continue
+        key = (query_result["region"], query_result["cn"])
+        newest = latest.get(key)
+        for image in query_result["api_results"]:
+            creation_date = _image_timestamp(image["CreationDate"])
+            if newest is None or creation_date > newest.creation_date:
+                newest = APIResultsData(
                     query_result["cn"],
-                    x["ImageId"],
-                    _image_timestamp(x["CreationDate"]),
+                    image["ImageId"],
+                    creation_date,
                     query_result["region"],
                 )
-                for x in query_result["api_results"]
-            ]
-            unsorted_results = cn_api_results_data + unsorted_results
-        else:
-            missing_results.append(query_result)
+        latest[key] = newest
 
     if missing_results:
         LOG.warning(
@@ -275,15 +529,7 @@ def reduce_api_results(raw_results):
     for missing_result in missing_results:
         LOG.warning(f"- {missing_result['cn']} in {missing_result['region']}")
 
-    sorted_results = sorted(unsorted_results, reverse=True)
-    for _r in sorted_results:
-        found_key = f"{_r.region}-{_r.codename}"
-        already_found = result_state.get(found_key, False)
-        if already_found:
-            continue
-        result_state[found_key] = True
-        final_results.append(_r)
-    return final_results
+    return sorted(latest.values(), reverse=True)
 
 
 class AMIUpdater:
@@ -295,7 +541,15 @@ class AMIUpdater:
         "taskcat/main/cfg/amiupdater.cfg.yml"
     )
 
-    def __init__(self, config, user_config_file=None, use_upstream_mappings=True):
+    def __init__(
+        self,
+        config,
+        user_config_file=None,
+        use_upstream_mappings=True,
+        refresh=False,
+        cache_ttl=AMI_CACHE_TTL,
+        cache_path=AMI_CACHE_PATH,
+    ):
         if use_upstream_mappings:
             Config.load(self.upstream_config_file, configtype="Upstream")
         if user_config_file:
@@ -303,26 +557,30 @@ class AMIUpdater:
         # TODO: Needed?
         self.config = config
         self.boto3_cache = Boto3Cache()
+        self.image_cache = ImageCache(cache_path, cache_ttl, refresh)
         self.template_list = self._determine_templates()
-        self.regions = self._get_regions()
+        # populated by update_amis once the templates' regions are known
+        self.regions: Dict[str, RegionObj] = {}
 
-    def _get_regions(self):
-        profile = (
-            self.config.config.general.auth.get("default", "default")
-            if self.config.config.general.auth
-            else "default"
-        )
-        default_region = self.boto3_cache.get_default_region(profile)
-        regions = [
-            _r["RegionName"]
-            for _r in self.boto3_cache.client(
-                "ec2", profile, default_region
-            ).describe_regions()["Regions"]
-        ]
-        regions = self.get_regions_for_profile(profile, regions)
-        if self.config.config.general.auth:
-            for region, profile in self.config.config.general.auth.items():
-                regions.update(self.get_regions_for_profile(profile, [region]))
+    def _get_regions(self, required_regions):
+        auth = self.config.config.general.auth or {}
+        profile = auth.get("default", "default")
+        regions = {}
+        default_profile_regions = sorted(set(required_regions) - set(auth))
+        if default_profile_regions:
+            default_region = self.boto3_cache.get_default_region(profile)
+            enabled = {
+                _r["RegionName"]
+                for _r in self.boto3_cache.client(
+                    "ec2", profile, default_region
+                ).describe_regions()["Regions"]
+            }
+            regions = self.get_regions_for_profile(
+                profile, [_r for _r in default_profile_regions if _r in enabled]
+            )
+        for region, region_profile in auth.items():
+            if region in required_regions:
+                regions.update(self.get_regions_for_profile(region_profile, [region]))
         return regions
 
     def get_regions_for_profile(self, profile, _regions):
@@ -370,9 +628,11 @@ class AMIUpdater:
             for tcn in template_cn:
                 codenames.add(tcn)
 
+        self.regions = self._get_regions({cn.region for cn in codenames})
+
         # Retrieve API Results.
         LOG.info("Retrieving results from the EC2 API")
-        results = query_codenames(codenames, self.regions)
+        results = iter_query_codenames(codenames, self.regions, self.image_cache)
 
         LOG.info("Determining the latest AMI for each Codename/Region")
         updated_api_results = reduce_api_results(results)
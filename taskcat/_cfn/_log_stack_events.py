@@ -2,6 +2,7 @@
 import datetime
 import logging
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List
 
@@ -12,6 +13,8 @@ from .threaded import Stacker
 
 LOG = logging.getLogger(__name__)
 
+MAX_WORKERS = 16
+
 
 class _CfnLogTools:
     def __init__(self):
@@ -41,82 +44,85 @@ class _CfnLogTools:
 
         return events
 
-    def createcfnlogs(self, stacks: Stacker, logpath: Path):
-        for stack in stacks.stacks:
-            stackname = stack.name
-            region = stack.region_name
-            extension = ".txt"
-            test_logpath = logpath / "{}-{}-{}{}".format(
-                stackname, region, "cfnlogs", extension
+    def createcfnlogs(
+        self, stacks: Stacker, logpath: Path, max_workers: int = MAX_WORKERS
+    ):
+        if not stacks.stacks:
+            return
+        with ThreadPoolExecutor(
+            max_workers=min(len(stacks.stacks), max_workers)
+        ) as executor:
+            trees = list(executor.map(self._stack_tree, stacks.stacks))
+            # events for every stack in every tree are fetched concurrently, the
+            # rendered logs come back in tree order
+            logs = executor.map(
+                self._render_log, [stack for tree in trees for stack in tree]
             )
-            self.write_logs(stack, test_logpath)
+            for tree in trees:
+                stack = tree[0]
+                test_logpath = logpath / "{}-{}-{}{}".format(
+                    stack.name, stack.region_name, "cfnlogs", ".txt"
+                )
+                content = "".join(next(logs) for _ in tree)
+                if content:
+                    with open(str(test_logpath), "a", encoding="utf-8") as log_output:
+                        log_output.write(content)
+
+    @staticmethod
+    def _stack_tree(stack: Stack) -> List[Stack]:
+        if stack.launch_exception:
+            return [stack]
+        return [stack] + list(stack.descendants(refresh=True))
 
     def write_logs(self, stack: Stack, logpath: Path):
+        content = "".join(self._render_log(s) for s in self._stack_tree(stack))
+        if content:
+            with open(str(logpath), "a", encoding="utf-8") as log_output:
+                log_output.write(content)
+
+    def _render_log(self, stack: Stack) -> str:
         stackname = stack.name
         region = stack.region_name
 
-        # Get stack resources
-        cfnlogs = self.get_cfnlogs(stack)
-
         if stack.launch_exception:
-            with open(str(logpath), "a", encoding="utf-8") as log_output:
-                log_output.write(stack.status_reason)
-            return
-
-        if len(cfnlogs) != 0:
-            if cfnlogs[0]["ResourceStatus"] != "CREATE_COMPLETE":
-                if "ResourceStatusReason" in cfnlogs[0]:
-                    reason = cfnlogs[0]["ResourceStatusReason"]
-                else:
-                    reason = "Unknown"
-            else:
-                reason = "Stack launch was successful"
+            return stack.status_reason
 
-            with open(str(logpath), "a", encoding="utf-8") as log_output:
-                log_output.write(
-                    "------------------------------------------------------------------"
-                    "-----------\n"
-                )
-                log_output.write("Region: " + region + "\n")
-                log_output.write("StackName: " + stackname + "\n")
-                log_output.write(
-                    "******************************************************************"
-                    "***********\n"
-                )
-                log_output.write("ResourceStatusReason:  \n")
-                log_output.write(textwrap.fill(str(reason), 85) + "\n")
-                log_output.write(
-                    "******************************************************************"
-                    "***********\n"
-                )
-                log_output.write(
-                    "******************************************************************"
-                    "***********\n"
-                )
-                log_output.write("Events:  \n")
-                log_output.writelines(tabulate.tabulate(cfnlogs, headers="keys"))
-                log_output.write(
-                    "\n****************************************************************"
-                    "*************\n"
-                )
-                log_output.write(
-                    "------------------------------------------------------------------"
-                    "-----------\n"
-                )
-                log_output.write(
-                    "Tested on: "
-                    + datetime.datetime.now().strftime("%A, %d. %B %Y %I:%M%p")
-                    + "\n"
-                )
-                log_output.write(
-                    "------------------------------------------------------------------"
-                    "-----------\n\n"
-                )
-                log_output.close()
+        # Get stack resources
+        cfnlogs = self.get_cfnlogs(stack)
 
-            for child in stack.descendants(refresh=True):
-                self.write_logs(child, logpath)
-        else:
+        if len(cfnlogs) == 0:
             LOG.error(
                 "No event logs found. Something went wrong at describe event " "call."
             )
+            return ""
+
+        if cfnlogs[0]["ResourceStatus"] != "CREATE_COMPLETE":
+            if "ResourceStatusReason" in cfnlogs[0]:
+                reason = cfnlogs[0]["ResourceStatusReason"]
+            else:
+                reason = "Unknown"
+        else:
+            reason = "Stack launch was successful"
+
+        divider = "-" * 77
+        stars = "*" * 77
+        return "".join(
+            [
+                divider + "\n",
+                "Region: " + region + "\n",
+                "StackName: " + stackname + "\n",
+                stars + "\n",
+                "ResourceStatusReason:  \n",
+                textwrap.fill(str(reason), 85) + "\n",
+                stars + "\n",
+                stars + "\n",
+                "Events:  \n",
+                tabulate.tabulate(cfnlogs, headers="keys"),
+                "\n" + stars + "\n",
+                divider + "\n",
+                "Tested on: "
+                + datetime.datetime.now().strftime("%A, %d. %B %Y %I:%M%p")
+                + "\n",
+                divider + "\n\n",
+            ]
+        )
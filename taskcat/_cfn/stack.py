@@ -566,6 +566,30 @@ class Stack:  # pylint: disable=too-many-instance-attributes
                         if stack_obj:
                             self._children.append(stack_obj)
 
+    def _fetch_descendants(self) -> Stacks:
+        # a single describe_stacks scan covers the whole tree, rather than one scan
+        # of the account's stacks for every stack in it
+        stacks_by_parent: dict = {}
+        for page in self.client.get_paginator("describe_stacks").paginate():
+            for stack in page["Stacks"]:
+                if "ParentId" in stack.keys():
+                    stacks_by_parent.setdefault(stack["ParentId"], []).append(stack)
+        return self._import_descendants(stacks_by_parent)
+
+    def _import_descendants(self, stacks_by_parent: dict) -> Stacks:
+        self._last_child_refresh = datetime.now()
+        for stack in stacks_by_parent.get(self.id, []):
+            if self._children.filter(id=stack["StackId"]):
+                continue
+            stack_obj = Stack._import_child(stack, self)
+            if stack_obj:
+                self._children.append(stack_obj)
+        # same order as descendants(): children first, then each child's subtree
+        descendants = Stacks(self._children)
+        for child in self._children:
+            descendants += Stack._import_descendants(child, stacks_by_parent)
+        return descendants
+
     def children(self, refresh=False) -> Stacks:
         if (
             refresh
@@ -576,12 +600,14 @@ class Stack:  # pylint: disable=too-many-instance-attributes
         return self._children
 
     def descendants(self, refresh=False) -> Stacks:
-        if refresh or not self._children:
+        if refresh:
+            return self._fetch_descendants()
+        if not self._children:
             self._fetch_children()
 
         def recurse(stack: Stack, descendants: Stacks = None) -> Stacks:
             descendants = descendants if descendants else Stacks()
-            if stack.children(refresh=refresh):
+            if stack.children():
                 descendants += stack.children()
                 for child in stack.children():
                     descendants = recurse(child, descendants)
@@ -1,8 +1,9 @@
 import logging
 from pathlib import Path
 
+from taskcat._cli_core import CliCore
 from taskcat._config import Config
-from taskcat._lambda_build import LambdaBuild
+from taskcat._lambda_build import LambdaBuild, LambdaBuildOptions
 
 LOG = logging.getLogger(__name__)
 
@@ -11,6 +12,7 @@ class Package:
     """packages lambda source files into zip files. If a dockerfile is present in a
     source folder, it will be run prior to zipping the contents"""
 
+    @CliCore.longform_param_required("pip_in_place")
     def __init__(
         self,
         project_root: str = "./",
@@ -19,6 +21,8 @@ class Package:
         config_file: str = ".taskcat.yml",
         from_ref: str = None,
         to_ref: str = None,
+        no_cache: bool = False,
+        pip_in_place: bool = False,
     ):
         """
         :param project_root: base path for project
@@ -26,6 +30,8 @@ class Package:
         project_root
         :param zip_folder: folder to output zip files, relative to the project root
         :param config_file: path to taskcat project config file
+        :param no_cache: rebuild all packages and resolve pip dependencies afresh
+        :param pip_in_place: run pip in the source folder instead of a copy of it
         """
         project_root_path: Path = Path(project_root).expanduser().resolve()
         project_config: Path = project_root_path / config_file
@@ -42,4 +48,12 @@ class Package:
         if not config.config.project.package_lambda:
             LOG.info("Lambda packaging disabled by config")
             return
-        LambdaBuild(config, project_root_path, from_ref, to_ref)
+        LambdaBuild(
+            config,
+            project_root_path,
+            from_ref,
+            to_ref,
+            options=LambdaBuildOptions(
+                use_cache=not no_cache, copy_pip_source=not pip_in_place
+            ),
+        )
@@ -3,6 +3,7 @@ import os
 from pathlib import Path
 
 from taskcat._amiupdater import (
+    AMI_CACHE_TTL,
     AMIUpdater,
     AMIUpdaterCommitNeededException,
     AMIUpdaterFatalException,
@@ -20,9 +21,16 @@ class UpdateAMI:
 
     CLINAME = "update-ami"
 
-    def __init__(self, project_root: str = "./"):
+    def __init__(
+        self,
+        project_root: str = "./",
+        refresh: bool = False,
+        cache_ttl: int = AMI_CACHE_TTL,
+    ):
         """
         :param project_root: base path for project
+        :param refresh: ignore cached AMI lookups and query EC2 for every codename
+        :param cache_ttl: seconds AMI lookups are cached for, 0 disables the cache
         """
 
         if project_root == "./":
@@ -35,7 +43,7 @@ class UpdateAMI:
             project_config_path=Path(_project_root / ".taskcat.yml"),
         )
 
-        amiupdater = AMIUpdater(config=config)
+        amiupdater = AMIUpdater(config=config, refresh=refresh, cache_ttl=cache_ttl)
         try:
             amiupdater.update_amis()
         except AMIUpdaterCommitNeededException:
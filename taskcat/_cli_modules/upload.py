@@ -68,4 +68,5 @@ class Upload:
             config.project_root,
             exclude_prefix,
             dry_run,
+            use_manifest=config.config.project.s3_sync_manifest,
         )
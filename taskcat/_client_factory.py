@@ -1,8 +1,15 @@
+import hashlib
+import json
 import logging
 import operator
-from functools import reduce
-from time import sleep
-from typing import Any, Dict, List
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, reduce
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import boto3
 import botocore.loaders as boto_loader
@@ -11,25 +18,45 @@ from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError, NoCredentialsError, ProfileNotFound
 
 from taskcat.exceptions import TaskCatException
+from taskcat.regions_to_partitions import REGIONS
 
 LOG = logging.getLogger(__name__)
 
 REGIONAL_ENDPOINT_SERVICES = ["sts"]
 
+IDENTITY_CACHE_PATH = Path("~/.taskcat_cache/identity.json").expanduser().resolve()
+
+_IDENTITY_CACHE_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _endpoint_resolver() -> boto_regions.EndpointResolver:
+    # parsing botocore's endpoints.json is expensive, do it once per process
+    return boto_regions.EndpointResolver(
+        boto_loader.create_loader().load_data("endpoints")
+    )
+
 
 class Boto3Cache:
-    RETRIES = 10
-    BACKOFF = 2
-    DELAY = 0.1
     CLIENT_THROTTLE_RETRIES = 20
+    IDENTITY_CACHE_TTL = 12 * 60 * 60
+    PARTITION_REGIONS = [
+        ("aws", "us-east-1"),
+        ("aws-cn", "cn-north-1"),
+        ("aws-us-gov", "us-gov-west-1"),
+    ]
 
-    def __init__(self, _boto3=boto3):
+    def __init__(
+        self, _boto3=boto3, identity_cache_path: Optional[Path] = IDENTITY_CACHE_PATH
+    ):
         self._boto3 = _boto3
+        self._identity_cache_path = identity_cache_path
         self._session_cache: Dict[str, Dict[str, boto3.Session]] = {}
         self._client_cache: Dict[str, Dict[str, Dict[str, boto3.client]]] = {}
         self._resource_cache: Dict[str, Dict[str, Dict[str, boto3.resource]]] = {}
         self._account_info: Dict[str, Dict[str, str]] = {}
-        self._lock_cache_update = False
+        self._locks: Dict[Tuple[str, ...], threading.RLock] = {}
+        self._locks_lock = threading.Lock()
 
     def session(self, profile: str = "default", region: str = None) -> boto3.Session:
         region = self._get_region(region, profile)
@@ -44,8 +71,12 @@ class Boto3Cache:
         except ProfileNotFound:
             if profile != "default":
                 raise
-            session = self._boto3.Session(region_name=region)
-            self._cache_set(self._session_cache, [profile, region], session)
+            with self._get_lock([profile, region]):
+                try:
+                    session = self._cache_get(self._session_cache, [profile, region])
+                except KeyError:
+                    session = self._boto3.Session(region_name=region)
+                    self._cache_set(self._session_cache, [profile, region], session)
         return session
 
     def client(
@@ -53,7 +84,9 @@ class Boto3Cache:
     ) -> boto3.client:
         region = self._get_region(region, profile)
         session = self.session(profile, region)
-        kwargs = {"config": BotoConfig(retries={"max_attempts": 20})}
+        kwargs = {
+            "config": BotoConfig(retries={"max_attempts": self.CLIENT_THROTTLE_RETRIES})
+        }
         if service in REGIONAL_ENDPOINT_SERVICES:
             kwargs.update({"endpoint_url": self._get_endpoint_url(service, region)})
         return self._cache_lookup(
@@ -76,6 +109,32 @@ class Boto3Cache:
             [service],
         )
 
+    def prewarm(
+        self,
+        profiles: Iterable[str],
+        regions: Iterable[str],
+        services: Iterable[str],
+        max_workers: int = 16,
+    ) -> List[Future]:
+        # builds the clients in the background and returns immediately; anything
+        # asking for the same client meanwhile waits on its lock instead of
+        # building a second one. Failures are left for the real caller to hit.
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [
+            executor.submit(self._prewarm_client, service, profile, region)
+            for profile in profiles
+            for region in regions
+            for service in services
+        ]
+        executor.shutdown(wait=False)
+        return futures
+
+    def _prewarm_client(self, service, profile, region):
+        try:
+            self.client(service, profile, region)
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.debug(f"failed to prewarm {service} client for {profile}/{region}: {e}")
+
     def partition(self, profile: str = "default") -> str:
         return self._cache_lookup(
             self._account_info, [profile], self._get_account_info, [profile]
@@ -87,68 +146,121 @@ class Boto3Cache:
         )["account_id"]
 
     def _get_account_info(self, profile):
-        partition, region = self._get_partition(profile)
-        session = self.session(profile, region)
-        sts_client = session.client("sts", region_name=region)
+        fingerprint = self._credential_fingerprint(profile)
+        account_info = self._identity_cache_get(fingerprint)
+        if account_info:
+            return account_info
         try:
-            account_id = sts_client.get_caller_identity()["Account"]
+            partition, _, account_id = self._probe_partitions(profile)
         except ClientError as e:
             if e.response["Error"]["Code"] == "AccessDenied":
                 # pylint: disable=raise-missing-from
                 raise TaskCatException(
-                    f"Not able to fetch account number from {region} using profile "
-                    f"{profile}. {str(e)}"
+                    f"Not able to fetch account number using profile {profile}. "
+                    f"{str(e)}"
                 )
             raise
-        except NoCredentialsError as e:
+        except (NoCredentialsError, ProfileNotFound) as e:
             # pylint: disable=raise-missing-from
             raise TaskCatException(
-                f"Not able to fetch account number from {region} using profile "
-                f"{profile}. {str(e)}"
+                f"Not able to fetch account number using profile {profile}. {str(e)}"
             )
-        except ProfileNotFound as e:
-            # pylint: disable=raise-missing-from
-            raise TaskCatException(
-                f"Not able to fetch account number from {region} using profile "
-                f"{profile}. {str(e)}"
-            )
-        return {"partition": partition, "account_id": account_id}
+        account_info = {"partition": partition, "account_id": account_id}
+        self._identity_cache_set(fingerprint, account_info)
+        return account_info
+
+    def _credential_fingerprint(self, profile) -> Optional[str]:
+        # the profile alone is not enough, the credentials behind it may have been
+        # swapped for another account's since the cache entry was written. Read them
+        # from the cached session the partition probes use, so that they (and any
+        # MFA prompt) are only resolved once.
+        try:
+            session = self.session(profile, self._partition_regions(profile)[0][1])
+            credentials = session.get_credentials()
+            access_key = credentials.access_key if credentials else None
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.debug(f"not caching identity for profile {profile}: {e}")
+            return None
+        if not isinstance(access_key, str):
+            return None
+        return hashlib.sha256(f"{profile}:{access_key}".encode("utf-8")).hexdigest()
+
+    def _read_identity_cache(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self._identity_cache_path, "r", encoding="utf-8") as fh:
+                cache = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+
+    def _identity_cache_get(self, fingerprint) -> Optional[Dict[str, str]]:
+        if not fingerprint or not self._identity_cache_path:
+            return None
+        with _IDENTITY_CACHE_LOCK:
+            entry = self._read_identity_cache().get(fingerprint)
+        if not entry or entry.get("expires", 0) < time.time():
+            return None
+        return {"partition": entry["partition"], "account_id": entry["account_id"]}
+
+    def _identity_cache_set(self, fingerprint, account_info: Dict[str, str]):
+        if not fingerprint or not self._identity_cache_path:
+            return
+        now = time.time()
+        with _IDENTITY_CACHE_LOCK:
+            cache = {
+                key: entry
+                for key, entry in self._read_identity_cache().items()
+                if isinstance(entry, dict) and entry.get("expires", 0) >= now
+            }
+            cache[fingerprint] = {
+                **account_info,
+                "expires": int(now + self.IDENTITY_CACHE_TTL),
+            }
+            try:
+                self._identity_cache_path.parent.mkdir(parents=True, exist_ok=True)
+                # write-then-rename, so concurrent taskcat processes never see a
+                # partially written file
+                with tempfile.NamedTemporaryFile(
+                    "w",
+                    dir=self._identity_cache_path.parent,
+                    delete=False,
+                    encoding="utf-8",
+                ) as fh:
+                    json.dump(cache, fh)
+                os.replace(fh.name, self._identity_cache_path)
+            except OSError as e:
+                LOG.debug(f"failed to write identity cache: {e}")
 
     def _make_parent_keys(self, cache: dict, keys: list):
         if keys:
-            if not cache.get(keys[0]):
-                cache[keys[0]] = {}
-            self._make_parent_keys(cache[keys[0]], keys[1:])
+            self._make_parent_keys(cache.setdefault(keys[0], {}), keys[1:])
+
+    def _get_lock(self, key_list: list) -> threading.RLock:
+        # botocore sessions are not thread-safe, so everything built from the same
+        # (profile, region) session shares one lock, other sessions build in parallel
+        with self._locks_lock:
+            return self._locks.setdefault(tuple(key_list[:2]), threading.RLock())
 
     def _cache_lookup(self, cache, key_list, create_func, args=None, kwargs=None):
         try:
-            value = self._cache_get(cache, key_list)
+            return self._cache_get(cache, key_list)
         except KeyError:
-            args = [] if not args else args
-            kwargs = {} if not kwargs else kwargs
-            value = self._get_with_retry(create_func, args, kwargs)
-            self._cache_set(cache, key_list, value)
-        return value
-
-    def _get_with_retry(self, create_func, args, kwargs):
-        retries = self.RETRIES
-        delay = self.DELAY
-        while retries:
+            pass
+        with self._get_lock(key_list):
+            # another thread may have created it while we were waiting for the lock
             try:
-                return create_func(*args, **kwargs)
-            except KeyError as e:
-                if str(e) not in ["'credential_provider'", "'endpoint_resolver'"]:
-                    raise
-                backoff = (self.RETRIES - retries + delay) * self.BACKOFF
-                sleep(backoff)
-        return None
+                return self._cache_get(cache, key_list)
+            except KeyError:
+                args = [] if not args else args
+                kwargs = {} if not kwargs else kwargs
+                value = create_func(*args, **kwargs)
+                self._cache_set(cache, key_list, value)
+        return value
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def _get_endpoint_url(service, region):
-        data = boto_loader.create_loader().load_data("endpoints")
-        endpoint_data = boto_regions.EndpointResolver(data).construct_endpoint(
-            service, region
-        )
+        endpoint_data = _endpoint_resolver().construct_endpoint(service, region)
         if not endpoint_data:
             raise TaskCatException(
                 f"unable to resolve endpoint for {service} in {region}"
@@ -169,35 +281,69 @@ class Boto3Cache:
         return region
 
     def _get_partition(self, profile):
-        partition_regions = [
-            ("aws", "us-east-1"),
-            ("aws-cn", "cn-north-1"),
-            ("aws-us-gov", "us-gov-west-1"),
+        partition, region, _ = self._probe_partitions(profile)
+        return (partition, region)
+
+    def _partition_regions(self, profile):
+        # the partition of the profile's own region is the likeliest, try it first
+        preferred = REGIONS.get(self._configured_region(profile), "aws")
+        return sorted(self.PARTITION_REGIONS, key=lambda item: item[0] != preferred)
+
+    def _probe_partitions(self, profile) -> Tuple[str, str, str]:
+        # every probe goes through the same session, so assume-role, SSO or MFA
+        # credentials are resolved once. The other partitions are only probed, all
+        # at once, if the credentials don't belong to the preferred one.
+        partition_regions = self._partition_regions(profile)
+        preferred_region = partition_regions[0][1]
+        identities = [
+            self._call_caller_identity(self.client("sts", profile, preferred_region))
         ]
-        for partition, region in partition_regions:
-            try:
-                self.session(profile, region).client(
-                    "sts", region_name=region
-                ).get_caller_identity()
-                return (partition, region)
-            except ClientError as e:
-                if "InvalidClientTokenId" in str(e):
-                    continue
-                raise
+        if identities[0] is None:
+            others = partition_regions[1:]
+            session = self.session(profile, preferred_region)
+            clients = [self._sts_client(session, region) for _, region in others]
+            with ThreadPoolExecutor(max_workers=len(others)) as executor:
+                futures = [
+                    executor.submit(self._call_caller_identity, client)
+                    for client in clients
+                ]
+            identities += [future.result() for future in futures]
+        for (partition, region), identity in zip(partition_regions, identities):
+            if identity is not None:
+                return (partition, region, identity["Account"])
         raise ValueError("cannot find suitable AWS partition")
 
-    def get_default_region(self, profile_name="default") -> str:
+    @staticmethod
+    def _call_caller_identity(sts_client):
+        try:
+            return sts_client.get_caller_identity()
+        except ClientError as e:
+            if "InvalidClientTokenId" in str(e):
+                return None
+            raise
+
+    def _sts_client(self, session, region):
+        return session.client(
+            "sts",
+            region_name=region,
+            endpoint_url=self._get_endpoint_url("sts", region),
+            config=BotoConfig(retries={"max_attempts": self.CLIENT_THROTTLE_RETRIES}),
+        )
+
+    def _configured_region(self, profile_name="default") -> Optional[str]:
         try:
             if profile_name != "default":
-                region = self._boto3.session.Session(
+                return self._boto3.session.Session(
                     profile_name=profile_name
                 ).region_name
-            else:
-                region = self._boto3.session.Session().region_name
+            return self._boto3.session.Session().region_name
         except ProfileNotFound:
             if profile_name != "default":
                 raise
-            region = self._boto3.session.Session().region_name
+            return self._boto3.session.Session().region_name
+
+    def get_default_region(self, profile_name="default") -> str:
+        region = self._configured_region(profile_name)
         if not region:
             _, region = self._get_partition(profile_name)
             LOG.warning(
@@ -3,14 +3,16 @@ import logging
 import os
 import re
 import sys
+import threading
 from collections import OrderedDict
 from functools import reduce
 from pathlib import Path
 from time import sleep
+from typing import Dict, Iterable
 
 import requests
 import yaml
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, ParamValidationError
 
 from dulwich.config import ConfigFile, parse_submodules
 from taskcat.exceptions import TaskCatException
@@ -27,6 +29,11 @@ S3_PARTITION_MAP = {
 FIRST_CAP_RE = re.compile("(.)([A-Z][a-z]+)")
 ALL_CAP_RE = re.compile("([a-z0-9])([A-Z])")
 
+# bucket regions don't change for the lifetime of a bucket, so lookups are shared
+# by every thread in the process
+_BUCKET_REGIONS: Dict[str, str] = {}
+_BUCKET_REGIONS_LOCK = threading.Lock()
+
 
 def region_from_stack_id(stack_id):
     return stack_id.split(":")[3]
@@ -36,13 +43,38 @@ def name_from_stack_id(stack_id):
     return stack_id.split(":")[5].split("/")[1]
 
 
+def cache_bucket_region(bucket, region):
+    with _BUCKET_REGIONS_LOCK:
+        _BUCKET_REGIONS[bucket] = region if region else "us-east-1"
+
+
+def clear_bucket_region_cache():
+    with _BUCKET_REGIONS_LOCK:
+        _BUCKET_REGIONS.clear()
+
+
 def s3_url_maker(bucket, key, s3_client, autobucket=False):
+    with _BUCKET_REGIONS_LOCK:
+        location = _BUCKET_REGIONS.get(bucket)
+    if not location:
+        location = _get_bucket_region(bucket, key, s3_client, autobucket)
+        cache_bucket_region(bucket, location)
+
+    # default case for us-east-1 which returns no location
+    url = f"https://{bucket}.s3.us-east-1.amazonaws.com/{key}"
+    if location and location != "us-east-1":
+        domain = get_s3_domain(location)
+        url = f"https://{bucket}.s3.{location}.{domain}/{key}"
+    return url
+
+
+def _get_bucket_region(bucket, key, s3_client, autobucket):
     retries = 10
     while True:
         try:
             try:
                 response = s3_client.get_bucket_location(Bucket=bucket)
-                location = response["LocationConstraint"]
+                return response["LocationConstraint"]
             except ClientError as e:
                 if e.response["Error"]["Code"] != "AccessDenied":
                     raise
@@ -55,20 +87,13 @@ def s3_url_maker(bucket, key, s3_client, autobucket=False):
                     raise TaskCatException(
                         f"failed to discover region for bucket {bucket}"
                     )
-            break
+                return location
         except s3_client.exceptions.NoSuchBucket:
             if not autobucket or retries < 1:
                 raise
             retries -= 1
             sleep(5)
 
-    # default case for us-east-1 which returns no location
-    url = f"https://{bucket}.s3.us-east-1.amazonaws.com/{key}"
-    if location:
-        domain = get_s3_domain(location)
-        url = f"https://{bucket}.s3.{location}.{domain}/{key}"
-    return url
-
 
 def get_s3_domain(region):
     try:
@@ -240,3 +265,51 @@ def fetch_secretsmanager_parameter_value(boto_client, secret_arn):
             "ARN: {} encountered an error: {}".format(secret_arn, str(e))
         )
     return response
+
+
+def fetch_ssm_parameter_values(
+    boto_client, parameter_paths: Iterable[str]
+) -> Dict[str, str]:
+    # best effort: anything missing from the result (not found, no permission for
+    # ssm:GetParameters) is left for fetch_ssm_parameter_value to report
+    ssm = boto_client("ssm")
+    paths = sorted(set(parameter_paths))
+    values: Dict[str, str] = {}
+    for i in range(0, len(paths), 10):
+        try:
+            response = ssm.get_parameters(Names=paths[i : i + 10])
+        except (ClientError, ParamValidationError) as e:
+            LOG.debug(f"failed to batch fetch ssm parameters: {e}")
+            continue
+        for parameter in response["Parameters"]:
+            name = parameter["Name"] + parameter.get("Selector", "")
+            values[name] = parameter["Value"]
+    return values
+
+
+def fetch_secretsmanager_parameter_values(
+    boto_client, secret_ids: Iterable[str]
+) -> Dict[str, str]:
+    # best effort, like fetch_ssm_parameter_values. Secrets referenced by a partial
+    # ARN can't be matched back to the request, so they are also left out
+    secrets_manager = boto_client("secretsmanager")
+    values: Dict[str, str] = {}
+    if not hasattr(secrets_manager, "batch_get_secret_value"):
+        # added in botocore 1.34, older versions fetch each secret on its own
+        LOG.debug("botocore is too old to batch fetch secrets")
+        return values
+    ids = sorted(set(secret_ids))
+    for i in range(0, len(ids), 20):
+        batch = ids[i : i + 20]
+        try:
+            response = secrets_manager.batch_get_secret_value(SecretIdList=batch)
+        except (AttributeError, ClientError, ParamValidationError) as e:
+            LOG.debug(f"failed to batch fetch secrets: {e}")
+            continue
+        for secret in response["SecretValues"]:
+            if "SecretString" not in secret:
+                continue
+            for secret_id in batch:
+                if secret_id in (secret.get("ARN"), secret.get("Name")):
+                    values[secret_id] = secret["SecretString"]
+    return values
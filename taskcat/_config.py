@@ -1,8 +1,11 @@
+import json
 import logging
 import os
+import secrets
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, Union
+from typing import Any, Dict, Optional, Tuple, Union
 
 import yaml
 from botocore.exceptions import ClientError
@@ -20,7 +23,12 @@ from taskcat._dataclasses import (
     generate_regional_bucket_name,
 )
 from taskcat._legacy_config import legacy_overrides, parse_legacy_config
-from taskcat._template_params import ParamGen
+from taskcat._template_params import (
+    ParamGen,
+    RenderContext,
+    prefetch_parameter_values,
+    prefill_availability_zones,
+)
 from taskcat.exceptions import TaskCatException
 
 LOG = logging.getLogger(__name__)
@@ -45,16 +53,21 @@ DEFAULTS = {
 
 class Config:
     def __init__(self, sources: list, uid: uuid.UUID, project_root: Path):
-        self.config = BaseConfig.from_dict(DEFAULTS)
-        self.config.set_source("TASKCAT_DEFAULT")
+        self.config = BaseConfig.from_sources(
+            [{"source": "TASKCAT_DEFAULT", "config": DEFAULTS}] + sources
+        )
         self.project_root = project_root
         self.uid = uid
-        for source in sources:
-            config_dict: dict = source["config"]
-            source_name: str = source["source"]
-            source_config = BaseConfig.from_dict(config_dict)
-            source_config.set_source(source_name)
-            self.config = BaseConfig.merge(self.config, source_config)
+        # resolved objects are memoized across calls and dropped whenever the
+        # config they were resolved from changes, see _resolution_cache
+        self._fingerprint: Optional[str] = None
+        self._boto3_cache: Optional[Boto3Cache] = None
+        self._region_cache: Dict[Tuple[str, str, Optional[str]], RegionObj] = {}
+        self._bucket_cache: Optional[Dict[str, Dict[str, S3BucketObj]]] = None
+        self._parameter_cache: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        # seeds generated parameter values, passwords included, so it must not be
+        # derivable from anything visible such as the taskcat-id tag
+        self._render_seed = secrets.token_hex()
 
     @classmethod
     # pylint: disable=too-many-locals
@@ -224,9 +237,28 @@ class Config:
                     config_dict[key_section][sub_key] = value
         return config_dict
 
+    def _resolution_cache(self):
+        # serialising the config isn't cheap, so this runs once per public call
+        # rather than once per test
+        fingerprint = json.dumps(self.config.to_dict(), sort_keys=True, default=str)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self._region_cache = {}
+            self._bucket_cache = None
+            self._parameter_cache = {}
+
+    def _get_boto3_cache(self, boto3_cache: Boto3Cache = None) -> Boto3Cache:
+        # callers that don't pass a cache (eg. clean_up) share the first one used,
+        # rather than starting over with empty sessions and account lookups
+        if boto3_cache is not None:
+            if self._boto3_cache is None:
+                self._boto3_cache = boto3_cache
+            return boto3_cache
+        if self._boto3_cache is None:
+            self._boto3_cache = Boto3Cache()
+        return self._boto3_cache
+
     def _get_regions(self, region_parameter_name, test, boto3_cache: Boto3Cache = None):
-        if boto3_cache is None:
-            boto3_cache = Boto3Cache()
         region_object = {}
         for region in getattr(test, region_parameter_name, []):
             # TODO: comon_utils/determine_profile_for_region
@@ -235,24 +267,34 @@ class Config:
                 if test.auth
                 else "default"
             )
-            region_object[region] = RegionObj(
-                name=region,
-                account_id=boto3_cache.account_id(profile),
-                partition=boto3_cache.partition(profile),
-                profile=profile,
-                _boto3_cache=boto3_cache,
-                taskcat_id=self.uid,
-                _role_name=test.role_name,
-            )
+            # a RegionObj only depends on these, so tests sharing them share one
+            key = (region, profile, test.role_name)
+            if key not in self._region_cache:
+                cache = self._get_boto3_cache(boto3_cache)
+                self._region_cache[key] = RegionObj(
+                    name=region,
+                    account_id=cache.account_id(profile),
+                    partition=cache.partition(profile),
+                    profile=profile,
+                    _boto3_cache=cache,
+                    taskcat_id=self.uid,
+                    _role_name=test.role_name,
+                )
+            region_object[region] = self._region_cache[key]
         return region_object
 
     def get_regions(self, boto3_cache: Boto3Cache = None):
+        self._resolution_cache()
         region_objects: Dict[str, Dict[str, RegionObj]] = {}
         for test_name, test in self.config.tests.items():
             region_objects[test_name] = self._get_regions("regions", test, boto3_cache)
         return region_objects
 
     def get_artifact_regions(self, boto3_cache: Boto3Cache = None):
+        self._resolution_cache()
+        return self._get_artifact_regions(boto3_cache)
+
+    def _get_artifact_regions(self, boto3_cache: Boto3Cache = None):
         region_objects: Dict[str, Dict[str, RegionObj]] = {}
         for test_name, test in self.config.tests.items():
             if test.artifact_regions is not None:
@@ -266,28 +308,57 @@ class Config:
         return region_objects
 
     def get_buckets(self, boto3_cache: Boto3Cache = None):
-        regions = self.get_artifact_regions(boto3_cache)
+        # buckets only depend on the config, so repeated calls (eg. from clean_up)
+        # return the already provisioned objects instead of generating new names
+        self._resolution_cache()
+        if self._bucket_cache is not None:
+            return self._bucket_cache
+        regions = self._get_artifact_regions(boto3_cache)
         bucket_objects: Dict[str, S3BucketObj] = {}
         bucket_mappings: Dict[str, Dict[str, S3BucketObj]] = {}
+        to_provision: Dict[str, Tuple[S3BucketObj, str]] = {}
         for test_name, test in self.config.tests.items():
             bucket_mappings[test_name] = {}
             for region_name, region in regions[test_name].items():
                 if test.s3_regional_buckets:
-                    bucket_obj = self._create_regional_bucket_obj(
+                    bucket_obj, action = self._create_regional_bucket_obj(
                         bucket_objects, region, test
                     )
                     bucket_objects[f"{region.account_id}{region.name}"] = bucket_obj
                 else:
-                    bucket_obj = self._create_legacy_bucket_obj(
+                    bucket_obj, action = self._create_legacy_bucket_obj(
                         bucket_objects, region, test
                     )
                     bucket_objects[region.account_id] = bucket_obj
+                if action and bucket_obj.name not in to_provision:
+                    to_provision[bucket_obj.name] = (bucket_obj, action)
                 bucket_mappings[test_name][region_name] = bucket_obj
 
+        if to_provision:
+            with ThreadPoolExecutor(max_workers=min(len(to_provision), 16)) as pool:
+                futures = [
+                    pool.submit(self._provision_bucket, bucket_obj, action)
+                    for bucket_obj, action in to_provision.values()
+                ]
+                for future in futures:
+                    future.result()
+
+        self._bucket_cache = bucket_mappings
         return bucket_mappings
 
+    @staticmethod
+    def _provision_bucket(bucket_obj: S3BucketObj, action: str):
+        if action == "check":
+            try:
+                bucket_obj.s3_client.head_bucket(Bucket=bucket_obj.name)
+                return
+            except ClientError as e:
+                if "(404)" not in str(e):
+                    raise
+        bucket_obj.create()
+
     def _create_legacy_bucket_obj(self, bucket_objects, region, test):
-        new = False
+        action = None
         object_acl = (
             self.config.project.s3_object_acl
             if self.config.project.s3_object_acl
@@ -298,7 +369,7 @@ class Config:
         if not test.s3_bucket and not bucket_objects.get(region.account_id):
             name = generate_bucket_name(self.config.project.name)
             auto_generated = True
-            new = True
+            action = "create"
         elif bucket_objects.get(region.account_id):
             name = bucket_objects[region.account_id].name
             auto_generated = bucket_objects[region.account_id].auto_generated
@@ -310,7 +381,10 @@ class Config:
             name=name,
             region=bucket_region,
             account_id=region.account_id,
-            s3_client=region.session.client("s3", region_name=bucket_region),
+            # pylint: disable=protected-access
+            s3_client=region._boto3_cache.client(
+                "s3", profile=region.profile, region=bucket_region
+            ),
             auto_generated=auto_generated,
             object_acl=object_acl,
             sigv4=sigv4,
@@ -319,13 +393,11 @@ class Config:
             regional_buckets=test.s3_regional_buckets,
             org_id=org_id,
         )
-        if new:
-            bucket_obj.create()
-        return bucket_obj
+        return bucket_obj, action
 
     def _create_regional_bucket_obj(self, bucket_objects, region, test):
         _bucket_obj_key = f"{region.account_id}{region.name}"
-        new = False
+        action = None
         object_acl = (
             self.config.project.s3_object_acl
             if self.config.project.s3_object_acl
@@ -339,25 +411,20 @@ class Config:
         if not test.s3_bucket and not bucket_objects.get(_bucket_obj_key):
             name = generate_regional_bucket_name(region)
             auto_generated = True
-            new = True
+            action = "create"
         elif bucket_objects.get(_bucket_obj_key):
             name = bucket_objects[_bucket_obj_key].name
             auto_generated = bucket_objects[_bucket_obj_key].auto_generated
         else:
             name = f"{test.s3_bucket}-{region.name}"
             auto_generated = False
-            try:
-                region.client("s3").head_bucket(Bucket=name)
-            except ClientError as e:
-                if "(404)" in str(e):
-                    new = True
-                else:
-                    raise
+            # created only if it does not exist yet
+            action = "check"
         bucket_obj = S3BucketObj(
             name=name,
             region=region.name,
             account_id=region.account_id,
-            s3_client=region.session.client("s3", region_name=region.name),
+            s3_client=region.client("s3"),
             auto_generated=auto_generated,
             object_acl=object_acl,
             sigv4=sigv4,
@@ -366,9 +433,7 @@ class Config:
             regional_buckets=test.s3_regional_buckets,
             org_id=org_id,
         )
-        if new:
-            bucket_obj.create()
-        return bucket_obj
+        return bucket_obj, action
 
     @staticmethod
     def _get_bucket_region_for_partition(partition):
@@ -380,29 +445,89 @@ class Config:
         return region
 
     def get_rendered_parameters(self, bucket_objects, region_objects, template_objects):
+        self._resolution_cache()
         parameters = {}
+        pending = []
         template_params = self.get_params_from_templates(template_objects)
         for test_name, test in self.config.tests.items():
             parameters[test_name] = {}
             for region_name in test.regions:
+                s3bucket = bucket_objects[test_name][region_name]
+                # rendering generates random values, so the same stack always has
+                # to get the same ones back
+                key = (test_name, region_name, s3bucket.name)
+                if key in self._parameter_cache:
+                    parameters[test_name][region_name] = self._parameter_cache[key]
+                    continue
                 region_params = template_params[test_name].copy()
                 for param_key, param_value in test.parameters.items():
                     if param_key in region_params:
                         region_params[param_key] = param_value
-                region = region_objects[test_name][region_name]
-                s3bucket = bucket_objects[test_name][region_name]
-                parameters[test_name][region_name] = ParamGen(
-                    self.project_root,
-                    region_params,
-                    s3bucket.name,
-                    region.name,
-                    region.client,
-                    self.config.project.name,
-                    test_name,
-                    test.az_blacklist,
-                ).results
+                pending.append((key, test, region_objects[test_name][region_name]))
+                parameters[test_name][region_name] = region_params
+        if pending:
+            self._render_pending(parameters, pending)
         return parameters
 
+    def _render_pending(self, parameters, pending):
+        # look up the availability zones of every region that needs them at once,
+        # rather than one region at a time as each one gets rendered
+        prefill_availability_zones(
+            region
+            for (test_name, region_name, _), _, region in pending
+            if ParamGen.needs_availability_zones(parameters[test_name][region_name])
+        )
+        prefetch_parameter_values(
+            (region, parameters[test_name][region_name])
+            for (test_name, region_name, _), _, region in pending
+        )
+        with ThreadPoolExecutor(max_workers=min(len(pending), 16)) as pool:
+            futures = [
+                pool.submit(
+                    self._render_parameters,
+                    parameters[key[0]][key[1]],
+                    key,
+                    test,
+                    region,
+                )
+                for key, test, region in pending
+            ]
+        self._collect_rendered(parameters, [key for key, _, _ in pending], futures)
+
+    def _collect_rendered(self, parameters, keys, futures):
+        errors = []
+        for key, future in zip(keys, futures):
+            try:
+                parameters[key[0]][key[1]] = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                errors.append((key, e))
+                continue
+            self._parameter_cache[key] = parameters[key[0]][key[1]]
+        # raise the first failure in test/region order, but don't hide the rest
+        for (test_name, region_name, _), error in errors[1:]:
+            LOG.error(f"failed to render parameters for {test_name}/{region_name}")
+            LOG.error(str(error))
+        if errors:
+            raise errors[0][1]
+
+    def _render_parameters(self, region_params, key, test, region):
+        test_name, region_name, bucket_name = key
+        return ParamGen(
+            self.project_root,
+            region_params,
+            bucket_name,
+            region.name,
+            region.client,
+            self.config.project.name,
+            test_name,
+            test.az_blacklist,
+            RenderContext(
+                region.account_id,
+                # unique per run, but the same whichever thread renders it
+                f"{self._render_seed}:{test_name}:{region_name}",
+            ),
+        ).results
+
     @staticmethod
     def get_params_from_templates(template_objects):
         parameters = {}
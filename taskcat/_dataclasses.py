@@ -2,17 +2,19 @@ import json
 import logging
 import random
 import string
-from dataclasses import dataclass, field
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from copy import deepcopy
+from dataclasses import MISSING, dataclass, field, fields
 from pathlib import Path
-from typing import Any, Dict, List, Mapping, NewType, Optional, Union
+from typing import Any, Dict, Iterable, List, Mapping, NewType, Optional, Tuple, Union
 from uuid import UUID, uuid5
 
 import boto3
 
-from dataclasses_jsonschema import FieldEncoder, JsonSchemaMixin
+from dataclasses_jsonschema import FieldEncoder, JsonSchemaMixin, ValidationError
 from taskcat._cfn.template import Template
 from taskcat._client_factory import Boto3Cache
-from taskcat._common_utils import merge_nested_dict
+from taskcat._common_utils import cache_bucket_region, merge_nested_dict
 from taskcat.exceptions import TaskCatException
 from taskcat.local_zones import ZONES as LOCAL_ZONES
 
@@ -105,6 +107,12 @@ METADATA: Mapping[str, Mapping[str, Any]] = {
         "default": False,
         "examples": [True, False],
     },
+    "s3_sync_manifest": {
+        "description": "Keep a manifest object at the project's S3 prefix and diff "
+        "against it on upload instead of listing every object",
+        "default": False,
+        "examples": [True, False],
+    },
     "role_name": {"description": "Role name to use when launching CFN Stacks."},
     "org_id": {
         "description": "Organization ID to use when launching CFN Stacks. starts with o-. It is found on Organization Settings page"
@@ -305,6 +313,7 @@ class S3BucketObj:
 
     def create(self):
         if self._bucket_matches_existing():
+            cache_bucket_region(self.name, self.region)
             return
         kwargs = {"Bucket": self.name}
         if self.region != "us-east-1":
@@ -336,32 +345,43 @@ class S3BucketObj:
             except Exception as inner_e:  # pylint: disable=broad-except
                 LOG.warning(f"failed to remove bucket {self.name}: {inner_e}")
             raise e
+        cache_bucket_region(self.name, self.region)
 
-    def empty(self):
+    def empty(self, max_in_flight: int = 8):
         if not self.auto_generated:
             LOG.error(f"Will not empty bucket created outside of taskcat {self.name}")
             return
-        objects_to_delete = []
-        pages = self.s3_client.get_paginator("list_objects_v2").paginate(
+        # each page is deleted as soon as it is listed, with at most max_in_flight
+        # delete_objects batches (of up to 1000 keys each) held in memory at once
+        pages = self.s3_client.get_paginator("list_object_versions").paginate(
             Bucket=self.name
         )
-        for page in pages:
-            objects = []
-            for obj in page.get("Contents", []):
-                del_obj = {"Key": obj["Key"]}
-                if obj.get("VersionId"):
-                    del_obj["VersionId"] = obj["VersionId"]
-                objects.append(del_obj)
-            objects_to_delete += objects
-        batched_objects = [
-            objects_to_delete[i : i + 1000]
-            for i in range(0, len(objects_to_delete), 1000)
-        ]
-        for objects in batched_objects:
-            if objects:
-                self.s3_client.delete_objects(
-                    Bucket=self.name, Delete={"Objects": objects}
-                )
+        in_flight: set = set()
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for page in pages:
+                objects = [
+                    {"Key": obj["Key"], "VersionId": obj["VersionId"]}
+                    for obj in page.get("Versions", []) + page.get("DeleteMarkers", [])
+                ]
+                for i in range(0, len(objects), 1000):
+                    if len(in_flight) >= max_in_flight:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    in_flight.add(
+                        executor.submit(self._delete_batch, objects[i : i + 1000])
+                    )
+            for future in in_flight:
+                future.result()
+
+    def _delete_batch(self, objects):
+        response = self.s3_client.delete_objects(
+            Bucket=self.name, Delete={"Objects": objects, "Quiet": True}
+        )
+        if response.get("Errors"):
+            for error in response["Errors"]:
+                LOG.error(f"S3 delete error in bucket {self.name}: {error}")
+            raise TaskCatException(f"Failed to empty bucket {self.name}")
 
     def delete(self, delete_objects=False):
         if not self.auto_generated:
@@ -632,6 +652,9 @@ class ProjectConfig(JsonSchemaMixin, allow_additional_props=False):  # type: ign
     s3_object_acl: Optional[S3Acl] = field(
         default="private", metadata=METADATA["s3_object_acl"]
     )
+    s3_sync_manifest: Optional[bool] = field(
+        default=None, metadata=METADATA["s3_sync_manifest"]
+    )
     shorten_stack_name: Optional[bool] = field(
         default=None, metadata=METADATA["shorten_stack_name"]
     )
@@ -693,11 +716,25 @@ class BaseConfig(JsonSchemaMixin, allow_additional_props=False):  # type: ignore
     # pylint doesn't like instance variables being added in post_init
     # pylint: disable=attribute-defined-outside-init
     def __post_init__(self):
-        self._source: Dict[str, Any] = {}
+        # provenance of every value, keyed by its path in the config, eg.:
+        # ("tests", "default", "parameters", "MyVar") -> ".taskcat.yml"
+        self._source_map: Dict[Tuple[str, ...], str] = {}
         self._propogate()
         self.set_source("UNKNOWN")
         self._propogate_source()
 
+    @property
+    def _source(self) -> Dict[str, Any]:
+        nested: Dict[str, Any] = {"general": {}, "project": {}, "tests": {}}
+        for test_name in self.tests:
+            nested["tests"][test_name] = {}
+        for path, source_name in self._source_map.items():
+            node = nested
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = source_name
+        return nested
+
     @staticmethod
     def _merge(source, dest):
         for section_key, section_value in source.items():
@@ -711,36 +748,97 @@ class BaseConfig(JsonSchemaMixin, allow_additional_props=False):  # type: ignore
         return dest
 
     def _propogate(self):
+        # the whole config has already been validated by the time we get here
         project_dict = self._merge(self.general.to_dict(), self.project.to_dict())
-        self.project = ProjectConfig.from_dict(project_dict)
+        self.project = ProjectConfig.from_dict(project_dict, validate=False)
         for test_key, test in self.tests.items():
             test_dict = self._merge(self.project.to_dict(), test.to_dict())
-            self.tests[test_key] = TestConfig.from_dict(test_dict)
+            self.tests[test_key] = TestConfig.from_dict(test_dict, validate=False)
+
+    @classmethod
+    def _propogate_dict(cls, config: dict):
+        config["project"] = cls._merge(deepcopy(config["general"]), config["project"])
+        for test_key, test in config["tests"].items():
+            config["tests"][test_key] = cls._merge(deepcopy(config["project"]), test)
 
     def _propogate_source(self):
-        self._source["project"] = self._merge(
-            self._source["general"], self._source["project"]
-        )
-        for test_key in self._source["tests"]:
-            test = self._merge(self._source["project"], self._source["tests"][test_key])
-            self._source["tests"][test_key] = test
-
-    def set_source(
-        self, source_name: str, dest: Optional[Any] = None
-    ) -> Optional[Union[str, dict]]:
-        base_case = False
-        if dest is None:
-            base_case = True
-            self._source = self.to_dict()
-            dest = self._source
-        if not isinstance(dest, dict):
-            return source_name
-        if isinstance(dest, dict):
-            for item in dest:
-                dest[item] = self.set_source(source_name, dest[item])
-        if not base_case:
-            return dest
-        return None
+        self._source_map = self._propogate_source_map(self._source_map, self.tests)
+
+    @staticmethod
+    def _propogate_source_map(
+        source_map: Dict[Tuple[str, ...], str], test_names: Iterable[str]
+    ) -> Dict[Tuple[str, ...], str]:
+        sections: Dict[Tuple[str, ...], Dict[Tuple[str, ...], str]] = {
+            ("general",): {},
+            ("project",): {},
+        }
+        for path, source_name in source_map.items():
+            root = path[:2] if path[0] == "tests" else path[:1]
+            sections.setdefault(root, {})[path[len(root) :]] = source_name
+
+        def merge(source, dest):
+            # same rules as _merge, applied to paths relative to each section
+            present = {path[0] for path in dest if path}
+            for path, source_name in source.items():
+                if not path:
+                    continue
+                if path[0] in PROPAGATE_KEYS or (
+                    path[0] in PROPOGATE_ITEMS and path[0] not in present
+                ):
+                    dest[path] = source_name
+
+        merge(sections[("general",)], sections[("project",)])
+        for test_name in test_names:
+            merge(sections[("project",)], sections.setdefault(("tests", test_name), {}))
+        return {
+            root + path: source_name
+            for root, section in sections.items()
+            for path, source_name in section.items()
+        }
+
+    def set_source(self, source_name: str):
+        self._source_map = _flatten_source(self.to_dict(), source_name)
+
+    @classmethod
+    def _normalise(cls, config: dict) -> dict:
+        # plain dict equivalent of cls.from_dict(config).to_dict(), skipping the
+        # schema validation and decoding
+        config = _apply_defaults(cls, config)
+        config["general"] = _apply_defaults(GeneralConfig, config["general"])
+        config["project"] = _apply_defaults(ProjectConfig, config["project"])
+        config["tests"] = {
+            test_key: _apply_defaults(TestConfig, test)
+            for test_key, test in config["tests"].items()
+        }
+        return config
+
+    @classmethod
+    def from_sources(cls, sources: List[Dict[str, Any]]) -> "BaseConfig":
+        """merges config sources in order (later sources win) on plain dicts, and
+        validates the result once"""
+        merged: Dict[str, Any] = {}
+        source_map: Dict[Tuple[str, ...], str] = {}
+        for source in sources:
+            try:
+                config = cls._normalise(deepcopy(source["config"]))
+                cls._propogate_dict(config)
+                source_map.update(_flatten_source(config, source["source"]))
+                merge_nested_dict(merged, config)
+                cls._propogate_dict(merged)
+                source_map = cls._propogate_source_map(source_map, merged["tests"])
+            except (AttributeError, TypeError, KeyError, ValueError):
+                # not shaped like a config, let the schema explain why
+                cls.from_dict(source["config"])
+                raise
+        try:
+            base_config = cls.from_dict(merged)
+        except ValidationError:
+            # blame the source that introduced the problem, if it is in a single one
+            for source in sources:
+                cls.from_dict(source["config"])
+            raise
+        base_config._source_map = source_map  # pylint: disable=protected-access
+        return base_config
 
     @classmethod
     def merge(
@@ -750,11 +848,43 @@ class BaseConfig(JsonSchemaMixin, allow_additional_props=False):  # type: ignore
         merged = base_config.to_dict()
         merge_nested_dict(merged, merge_config.to_dict())
 
-        merged_source = base_config._source.copy()
-        merge_nested_dict(merged_source, merge_config._source)
-
         config = cls.from_dict(merged)
 
-        config._source = merged_source
-        config._propogate_source()  # pylint: disable=protected-access
+        # pylint: disable=protected-access
+        config._source_map = {**base_config._source_map, **merge_config._source_map}
+        config._propogate_source()
         return config
+
+
+def _apply_defaults(dataclass_type, values: dict) -> dict:
+    # fills in the same defaults a round trip through dataclass_type would
+    result: Dict[str, Any] = {}
+    for dataclass_field in fields(dataclass_type):
+        if dataclass_field.default is not MISSING:
+            default = dataclass_field.default
+        elif dataclass_field.default_factory is not MISSING:  # type: ignore
+            default = dataclass_field.default_factory()  # type: ignore
+            if isinstance(default, JsonSchemaMixin):
+                default = default.to_dict()
+        else:
+            continue
+        if default is not None:
+            result[dataclass_field.name] = default
+    for key, value in values.items():
+        if key in ["prehooks", "posthooks"]:
+            result[key] = [_apply_defaults(HookData, hook) for hook in value]
+        else:
+            result[key] = value
+    return result
+
+
+def _flatten_source(
+    config: dict, source_name: str, path: Tuple[str, ...] = ()
+) -> Dict[Tuple[str, ...], str]:
+    source_map: Dict[Tuple[str, ...], str] = {}
+    for key, value in config.items():
+        if isinstance(value, dict):
+            source_map.update(_flatten_source(value, source_name, path + (key,)))
+        else:
+            source_map[path + (key,)] = source_name
+    return source_map
@@ -1,10 +1,19 @@
+import hashlib
+import io
+import json
 import logging
 import os
 import shutil
 import tarfile
 import tempfile
+import zipfile
+from concurrent.futures import ALL_COMPLETED, FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
 from subprocess import PIPE, CalledProcessError, run as subprocess_run  # nosec
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
 from uuid import UUID, uuid5
 
 from requests.exceptions import ReadTimeout
@@ -20,9 +29,51 @@ from .exceptions import TaskCatException
 
 LOG = logging.getLogger(__name__)
 
+PIP_CACHE_PATH = Path("~/.taskcat_cache/lambda_pip").expanduser().resolve()
+
+
+@dataclass
+class LambdaBuildOptions:
+    """
+    Tuning for LambdaBuild, the defaults suit most projects.
+
+    :param max_docker_builds: number of packages built with docker concurrently
+    :param max_pip_builds: number of packages built with pip concurrently
+    :param fail_fast: stop scheduling builds after the first failure, otherwise
+    build everything and report all failures at the end
+    :param use_cache: keep the existing lambda.zip of packages whose source and
+    build tool haven't changed since they were last built, and let pip builds
+    install offline from the wheelhouse when it has everything they need
+    :param zip_compression_level: zlib compression level used for lambda.zip, 0
+    stores files uncompressed and 9 is smallest
+    :param pip_cache_path: directory holding pip's cache and the wheelhouse that
+    pip builds install from, shared by all packages and runs
+    :param copy_pip_source: run pip in a copy of the package source, so that
+    requirements which build local packages in place (".", "./lib") don't leave
+    build output in the source folder or in lambda.zip
+    """
+
+    # docker builds load the docker daemon, pip builds mostly wait on the network
+    max_docker_builds: int = 2
+    max_pip_builds: int = 4
+    fail_fast: bool = True
+    use_cache: bool = True
+    zip_compression_level: int = 6
+    pip_cache_path: Path = PIP_CACHE_PATH
+    copy_pip_source: bool = True
+
 
 class LambdaBuild:
     NULL_UUID = UUID("{00000000-0000-0000-0000-000000000000}")
+    MAX_ZIP_BUILDS = 4
+
+    # dot-prefixed, so S3Sync doesn't upload it along with the packages
+    manifest_name = ".taskcat-lambda-manifest.json"
+    manifest_version = 1
+    # zip timestamps can't predate 1980, so that's used for every entry
+    ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+    _pip_version: Optional[str] = None
+    _pip_version_lock = Lock()
 
     def __init__(
         self,
@@ -31,8 +82,23 @@ class LambdaBuild:
         from_ref: str = None,
         to_ref: str = None,
         single_package_name: str = None,
+        options: Optional[LambdaBuildOptions] = None,
     ):
+        """
+        :param options: build concurrency, caching and packaging settings
+        """
+        self._options = options or LambdaBuildOptions()
         self._dirs_with_changes = set()
+        self._jobs: List[Tuple[str, Path, Path]] = []
+        self._max_builds = {
+            "docker": self._options.max_docker_builds,
+            "pip": self._options.max_pip_builds,
+            "zip": self.MAX_ZIP_BUILDS,
+        }
+        self._pip_cache_path = Path(self._options.pip_cache_path).expanduser().resolve()
+        self._wheelhouse_path = self._pip_cache_path / "wheelhouse"
+        self._manifests: Dict[Path, Dict[str, str]] = {}
+        self._manifest_lock = Lock()
         self._docker = docker.from_env()
         self._config = config
         self._project_root = Path(project_root).expanduser().resolve()
@@ -50,6 +116,7 @@ class LambdaBuild:
         self._determine_relative_changes_from_commits(from_ref, to_ref)
         self._build_lambdas(self._lambda_source_path, self._lambda_zip_path)
         self._build_submodules()
+        self._run_builds()
 
     def _determine_relative_changes_from_commits(self, from_ref, to_ref):  # noqa: C901
         if (not from_ref) or (not to_ref):
@@ -111,119 +178,405 @@ class LambdaBuild:
                 if path != self._single_package_path:
                     continue
             if (path / "Dockerfile").is_file():
-                tag = f"taskcat-build-{uuid5(self.NULL_UUID, str(path)).hex}"
-                LOG.info(
-                    f"Packaging lambda source from {path} using docker image {tag}"
-                )
-                self._docker_build(path, tag)
-                self._docker_extract(tag, output_path / path.stem)
+                kind = "docker"
             elif (path / "requirements.txt").is_file():
-                LOG.info(f"Packaging python lambda source from {path} using pip")
-                self._pip_build(path, output_path / path.stem)
+                kind = "pip"
             else:
-                LOG.info(
-                    f"Packaging lambda source from {path} without building "
-                    f"dependencies"
-                )
-                self._zip_dir(path, output_path / path.stem)
+                kind = "zip"
+            # packages don't depend on each other, so they are only queued here and
+            # built concurrently once every source path has been walked
+            self._jobs.append((kind, path, output_path / path.stem))
+
+    def _run_builds(self):
+        if not self._jobs:
+            return
+        pools = {
+            kind: ThreadPoolExecutor(max_workers=max_builds)
+            for kind, max_builds in self._max_builds.items()
+        }
+        futures = {}
+        self._load_manifests()
+        try:
+            for kind, path, package_path in self._jobs:
+                future = pools[kind].submit(self._build, kind, path, package_path)
+                futures[future] = path
+            _, not_done = wait(
+                futures,
+                return_when=(
+                    FIRST_EXCEPTION if self._options.fail_fast else ALL_COMPLETED
+                ),
+            )
+            for future in not_done:
+                future.cancel()
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+            self._save_manifests()
+        self._jobs = []
+        failed = [
+            (path, future.exception())
+            for future, path in futures.items()
+            if not future.cancelled() and future.exception()
+        ]
+        if not failed:
+            return
+        if len(failed) == 1:
+            raise failed[0][1]
+        for path, error in failed:
+            LOG.error(f"failed to package lambda source from {path}: {error}")
+        raise TaskCatException(
+            f"{len(failed)} lambda packages failed to build"
+        ) from failed[0][1]
+
+    def _load_manifests(self):
+        self._manifests = {}
+        for _, _, package_path in self._jobs:
+            zip_path = package_path.parent
+            if zip_path in self._manifests:
+                continue
+            self._manifests[zip_path] = {}
+            try:
+                manifest = json.loads((zip_path / self.manifest_name).read_text())
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                LOG.warning(f"ignoring unreadable lambda build manifest: {e}")
+                continue
+            if manifest.get("version") == self.manifest_version:
+                self._manifests[zip_path] = manifest.get("packages", {})
+
+    def _save_manifests(self):
+        for zip_path, packages in self._manifests.items():
+            manifest_path = zip_path / self.manifest_name
+            if not zip_path.is_dir() or not (packages or manifest_path.is_file()):
+                continue
+            manifest = {"version": self.manifest_version, "packages": packages}
+            manifest_path.write_text(
+                json.dumps(manifest, indent=2, sort_keys=True) + "\n"
+            )
+
+    @classmethod
+    def _get_pip_version(cls):
+        with cls._pip_version_lock:
+            if cls._pip_version is None:
+                try:
+                    cls._pip_version = subprocess_run(  # nosec
+                        ["pip", "--version"], check=True, stdout=PIPE, stderr=PIPE
+                    ).stdout.decode("utf-8", errors="replace")
+                except (FileNotFoundError, CalledProcessError):
+                    cls._pip_version = ""
+            return cls._pip_version
+
+    def _build_tool_version(self, kind):
+        if kind == "docker":
+            return str(self._docker.version().get("Version"))
+        if kind == "pip":
+            return self._get_pip_version()
+        return ""
+
+    @staticmethod
+    def _hash_source(path: Path, source_hash):
+        # requirements.txt and Dockerfile are part of the source tree, so changes to
+        # either are picked up along with the function code
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                file_path = Path(root) / file
+                source_hash.update(file_path.relative_to(path).as_posix().encode())
+                source_hash.update(b"\0x" if os.access(file_path, os.X_OK) else b"\0")
+                with open(file_path, "rb") as file_handle:
+                    for data in iter(partial(file_handle.read, 1024 * 1024), b""):
+                        source_hash.update(data)
+                source_hash.update(b"\0")
+
+    def _cache_key(self, kind, path):
+        source_hash = hashlib.sha256()
+        tool_version = self._build_tool_version(kind)
+        source_hash.update(
+            f"{kind}\0{tool_version}\0{self._options.zip_compression_level}\0".encode()
+        )
+        self._hash_source(path, source_hash)
+        return source_hash.hexdigest()
+
+    def _build(self, kind, path, package_path):
+        packages = self._manifests.setdefault(package_path.parent, {})
+        cache_key = self._cache_key(kind, path) if self._options.use_cache else None
+        with self._manifest_lock:
+            cached_key = packages.pop(package_path.name, None)
+        if cache_key and cache_key == cached_key:
+            if (package_path / "lambda.zip").is_file():
+                LOG.info(f"Lambda source in {path} is unchanged, skipping build")
+                with self._manifest_lock:
+                    packages[package_path.name] = cache_key
+                return
+        if kind == "docker":
+            tag = f"taskcat-build-{uuid5(self.NULL_UUID, str(path)).hex}"
+            LOG.info(f"Packaging lambda source from {path} using docker image {tag}")
+            self._docker_build(path, tag)
+            self._docker_extract(tag, package_path)
+        elif kind == "pip":
+            LOG.info(f"Packaging python lambda source from {path} using pip")
+            self._pip_build(path, package_path)
+        else:
+            LOG.info(
+                f"Packaging lambda source from {path} without building dependencies"
+            )
+            self._zip_dir(path, package_path)
+        LOG.info(f"Packaged lambda source from {path}")
+        if cache_key:
+            with self._manifest_lock:
+                packages[package_path.name] = cache_key
 
     @staticmethod
-    def _make_pip_command(base_path):
+    def _make_pip_command(base_path, target_path, wheelhouse_path, cache_path=None):
+        # without a cache_path pip installs from the wheelhouse alone, offline
+        if cache_path is None:
+            source_args = ["--no-index"]
+        else:
+            source_args = ["--cache-dir", str(cache_path)]
         return [
             "pip",
             "install",
-            "--no-cache-dir",
+            *source_args,
+            "--find-links",
+            str(wheelhouse_path),
             "--no-color",
             "--disable-pip-version-check",
             "--upgrade",
             "--requirement",
             str(base_path / "requirements.txt"),
             "--target",
-            str(base_path),
+            str(target_path),
         ]
 
-    @classmethod
-    def _pip_build(cls, base_path, output_path):
+    @staticmethod
+    def _make_pip_wheel_command(base_path, wheel_path, wheelhouse_path, cache_path):
+        return [
+            "pip",
+            "wheel",
+            "--cache-dir",
+            str(cache_path),
+            "--find-links",
+            str(wheelhouse_path),
+            "--no-color",
+            "--disable-pip-version-check",
+            "--requirement",
+            str(base_path / "requirements.txt"),
+            "--wheel-dir",
+            str(wheel_path),
+        ]
+
+    @staticmethod
+    def _run_pip(command, cwd, base_path):
+        LOG.debug("command is '%s'", command)
+        try:
+            completed_proc = subprocess_run(  # nosec
+                command, cwd=cwd, check=True, stdout=PIPE, stderr=PIPE
+            )
+        except FileNotFoundError as e:
+            raise TaskCatException(f"pip build of {base_path} failed") from e
+        LOG.debug("--- pip stdout for %s:\n%s", base_path, completed_proc.stdout)
+        LOG.debug("--- pip stderr for %s:\n%s", base_path, completed_proc.stderr)
+
+    def _pip_install_offline(self, command, cwd, base_path):
+        try:
+            self._run_pip(command, cwd, base_path)
+        except CalledProcessError as e:
+            LOG.debug("--- wheelhouse install for %s failed:\n%s", base_path, e.stderr)
+            return False
+        return True
+
+    def _fill_wheelhouse(self, source_path, base_path):
+        # best effort, so the next build can install offline. Wheels are built into
+        # a private directory and then moved into place, so concurrent builds never
+        # install from a partially written wheel
+        wheel_path = Path(tempfile.mkdtemp(dir=self._pip_cache_path))
+        try:
+            self._run_pip(
+                self._make_pip_wheel_command(
+                    source_path,
+                    wheel_path,
+                    self._wheelhouse_path,
+                    self._pip_cache_path / "pip",
+                ),
+                source_path,
+                base_path,
+            )
+            for wheel in wheel_path.iterdir():
+                os.replace(wheel, self._wheelhouse_path / wheel.name)
+        except CalledProcessError as e:
+            LOG.debug("--- wheelhouse refresh for %s failed:\n%s", base_path, e.stderr)
+        finally:
+            shutil.rmtree(wheel_path, ignore_errors=True)
+
+    def _pip_build(self, base_path, output_path):
         tmp_path = Path(tempfile.mkdtemp())
         try:
-            build_path = tmp_path / "build"
-            shutil.copytree(base_path, build_path)
-            command = cls._make_pip_command(build_path)
-            LOG.debug("command is '%s'", command)
+            if self._options.copy_pip_source:
+                source_path = tmp_path / "build"
+                shutil.copytree(base_path, source_path)
+            else:
+                source_path = base_path
+            target_path = tmp_path / "target"
+            self._wheelhouse_path.mkdir(parents=True, exist_ok=True)
 
-            LOG.info("Starting pip build.")
+            LOG.info(f"Starting pip build of {base_path}")
             try:
-                completed_proc = subprocess_run(  # nosec
-                    command, cwd=build_path, check=True, stdout=PIPE, stderr=PIPE
-                )
-            except (FileNotFoundError, CalledProcessError) as e:
-                raise TaskCatException("pip build failed") from e
-            LOG.debug("--- pip stdout:\n%s", completed_proc.stdout)
-            LOG.debug("--- pip stderr:\n%s", completed_proc.stderr)
-            cls._zip_dir(build_path, output_path)
+                # the wheelhouse usually has everything a rebuild needs. Anything it
+                # can't satisfy offline (new or unpinned versions, local or VCS
+                # requirements and their build backends) goes through a normal
+                # install against the index, as does every build with the cache off
+                if not self._options.use_cache or not self._pip_install_offline(
+                    self._make_pip_command(
+                        source_path, target_path, self._wheelhouse_path
+                    ),
+                    source_path,
+                    base_path,
+                ):
+                    LOG.info(f"Fetching dependencies of {base_path}")
+                    shutil.rmtree(target_path, ignore_errors=True)
+                    self._run_pip(
+                        self._make_pip_command(
+                            source_path,
+                            target_path,
+                            self._wheelhouse_path,
+                            self._pip_cache_path / "pip",
+                        ),
+                        source_path,
+                        base_path,
+                    )
+                    self._fill_wheelhouse(source_path, base_path)
+            except CalledProcessError as e:
+                LOG.error("--- pip stderr for %s:\n%s", base_path, e.stderr)
+                raise TaskCatException(f"pip build of {base_path} failed") from e
+            self._zip_dir(source_path, output_path, target_path)
             shutil.rmtree(tmp_path, ignore_errors=True)
         except Exception as e:  # pylint: disable=broad-except
             shutil.rmtree(tmp_path, ignore_errors=True)
             raise e
 
-    @staticmethod
-    def _zip_dir(build_path, output_path):
+    def _zip_dir(self, build_path, output_path, *overlay_paths):
+        # entries are sorted and carry fixed timestamps and permissions, so identical
+        # source always produces an identical zip and S3Sync sees an unchanged etag.
+        # Files in overlay_paths replace files at the same path in build_path.
+        entries: Dict[str, Optional[Path]] = {}
+        for root_path in [Path(build_path), *map(Path, overlay_paths)]:
+            for root, _, files in os.walk(root_path):
+                rel_root = Path(root).relative_to(root_path)
+                if rel_root != Path("."):
+                    entries[f"{rel_root.as_posix()}/"] = None
+                for file in files:
+                    entries[(rel_root / file).as_posix()] = Path(root) / file
         output_path.mkdir(parents=True, exist_ok=True)
         zip_path = output_path / "lambda.zip"
-        if zip_path.is_file():
-            zip_path.unlink()
-        shutil.make_archive(output_path / "lambda", "zip", build_path)
+        tmp_zip_path = output_path / ".lambda.zip.tmp"
+        try:
+            with zipfile.ZipFile(tmp_zip_path, "w") as zip_file:
+                for arcname in sorted(entries):
+                    if entries[arcname] is None:
+                        self._zip_add_dir(zip_file, arcname)
+                    else:
+                        self._zip_add_file(zip_file, entries[arcname], arcname)
+            os.replace(tmp_zip_path, zip_path)
+        finally:
+            if tmp_zip_path.exists():
+                tmp_zip_path.unlink()
+
+    def _zip_add_dir(self, zip_file, arcname):
+        info = zipfile.ZipInfo(arcname, self.ZIP_DATE_TIME)
+        info.create_system = 3
+        info.external_attr = (0o40755 << 16) | 0x10
+        zip_file.writestr(info, b"")
+
+    def _zip_add_file(self, zip_file, file_path, arcname):
+        info = zipfile.ZipInfo(arcname, self.ZIP_DATE_TIME)
+        info.create_system = 3
+        mode = 0o755 if os.access(file_path, os.X_OK) else 0o644
+        info.external_attr = (0o100000 | mode) << 16
+        info.file_size = file_path.stat().st_size
+        if self._options.zip_compression_level:
+            info.compress_type = zipfile.ZIP_DEFLATED
+            # ZipFile.open() has no compresslevel argument, the level is read from
+            # the ZipInfo when the entry is written
+            info._compresslevel = (  # pylint: disable=protected-access
+                self._options.zip_compression_level
+            )
+        with open(file_path, "rb") as source, zip_file.open(info, "w") as dest:
+            shutil.copyfileobj(source, dest, 1024 * 1024)
 
     @staticmethod
     def _docker_build(path, tag):
         cli = APIClient()
-        build_logs = []
-        for line in cli.build(path=str(path), tag=tag):
-            build_logs.append(line)
-        output = []
-        for line in build_logs:
-            output.append(line.decode("utf-8").strip())
-        LOG.debug("docker build logs: \n{}".format("\n".join(output)))
-
-    def _docker_extract(self, tag, package_path):  # noqa: C901
+        for chunk in cli.build(path=str(path), tag=tag, decode=True):
+            if "error" in chunk:
+                raise TaskCatException(
+                    f"docker build of {path} failed: {chunk['error'].strip()}"
+                )
+            if chunk.get("stream", "").strip():
+                LOG.debug("docker build %s: %s", path, chunk["stream"].rstrip())
+
+    def _docker_extract(self, tag, package_path):
         container = self._docker.containers.run(image=tag, detach=True)
+        for line in container.logs(stream=True, follow=True):
+            LOG.debug("docker run %s: %s", tag, line.decode("utf-8").rstrip())
         exit_code = container.wait()["StatusCode"]
-        logs = container.logs()
-        LOG.debug("docker run logs: \n{}".format(logs.decode("utf-8").strip()))
         if exit_code != 0:
-            raise TaskCatException("docker build failed")
+            raise TaskCatException(f"docker build of {tag} failed")
         arc, _ = container.get_archive("/output/")
-        with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-            for chunk in arc:
-                tmpfile.write(chunk)
-        with tarfile.open(tmpfile.name) as tar:
-            for member in tar.getmembers():
-                if member.name.startswith("output/"):
-                    member.name = member.name[len("output/") :]
-                    tar.extract(member)
-
-            def is_within_directory(directory, target):
-
-                abs_directory = os.path.abspath(directory)
-                abs_target = os.path.abspath(target)
+        # the archive is read as a stream, so nothing is buffered on disk or in
+        # memory beyond the file currently being written
+        with tarfile.open(fileobj=_ChunkReader(arc), mode="r|") as tar:
+            for member in tar:
+                self._extract_output_member(tar, member, Path(package_path))
+        try:
+            container.remove()
+        except ReadTimeout:
+            LOG.warning(f"Could not remove container {container.id}")
 
-                prefix = os.path.commonprefix([abs_directory, abs_target])
+    @staticmethod
+    def _extract_output_member(tar, member, package_path):
+        name = Path(member.name)
+        if name.parts[:1] != ("output",) or len(name.parts) == 1:
+            return
+        dest = (package_path / Path(*name.parts[1:])).resolve()
+        if package_path.resolve() not in dest.parents:
+            raise TaskCatException(
+                f"Attempted path traversal in docker output: {member.name}"
+            )
+        if member.isdir():
+            dest.mkdir(parents=True, exist_ok=True)
+            return
+        if not member.isfile():
+            LOG.warning(f"Skipping {member.name} in docker output, not a regular file")
+            return
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dest = dest.with_name(f".{dest.name}.tmp")
+        try:
+            with tar.extractfile(member) as source, open(tmp_dest, "wb") as out:
+                shutil.copyfileobj(source, out, 1024 * 1024)
+            os.replace(tmp_dest, dest)
+        finally:
+            if tmp_dest.exists():
+                tmp_dest.unlink()
 
-                return prefix == abs_directory
 
-            def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
+class _ChunkReader(io.RawIOBase):
+    """File-like view over an iterable of bytes chunks, such as docker archives."""
 
-                for member in tar.getmembers():
-                    member_path = os.path.join(path, member.name)
-                    if not is_within_directory(path, member_path):
-                        raise Exception("Attempted Path Traversal in Tar File")
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
 
-                tar.extractall(path, members, numeric_owner=numeric_owner)  # nosec
+    def readable(self):
+        return True
 
-            safe_extract(tar, path=str(package_path))
-        try:
-            container.remove()
-        except ReadTimeout:
-            LOG.warning(f"Could not remove container {container.id}")
-        os.unlink(tmpfile.name)
-        os.removedirs(str(package_path / "output"))
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
@@ -23,7 +23,14 @@ class S3BucketCreatorException(TaskCatException):
     pass
 
 
-def stage_in_s3(buckets, project_name, project_root, exclude_prefix, dry_run=False):
+def stage_in_s3(
+    buckets,
+    project_name,
+    project_root,
+    exclude_prefix,
+    dry_run=False,
+    use_manifest=False,
+):
     distinct_buckets = {}
 
     for test in buckets.values():
@@ -36,13 +43,16 @@ def stage_in_s3(buckets, project_name, project_root, exclude_prefix, dry_run=Fal
         project_root=project_root,
         dry_run=dry_run,
         exclude_prefix=exclude_prefix,
+        use_manifest=use_manifest,
     )
     pool.map(func, distinct_buckets.values())
     pool.close()
     pool.join()
 
 
-def _sync_wrap(bucket, project_name, project_root, dry_run, exclude_prefix):
+def _sync_wrap(  # pylint: disable=too-many-arguments
+    bucket, project_name, project_root, dry_run, exclude_prefix, use_manifest
+):
     if exclude_prefix:
         S3Sync.exclude_remote_path_prefixes += exclude_prefix
         S3Sync.exclude_path_prefixes += exclude_prefix
@@ -53,4 +63,5 @@ def _sync_wrap(bucket, project_name, project_root, dry_run, exclude_prefix):
         project_root,
         bucket.object_acl,
         dry_run=dry_run,
+        use_manifest=use_manifest,
     )
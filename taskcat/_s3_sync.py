@@ -1,16 +1,20 @@
 import fnmatch
+import gzip
 import hashlib
+import json
 import logging
 import os
 import time
 from functools import partial
-from multiprocessing.dummy import Pool as ThreadPool
 from typing import List
 
 from boto3.exceptions import S3UploadFailedError
 from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
 
 import pathspec
+from s3transfer.manager import TransferManager
+from s3transfer.utils import ChunksizeAdjuster
 from taskcat._logger import PrintMsg
 from taskcat.exceptions import TaskCatException
 
@@ -28,6 +32,11 @@ class S3Sync:
           https://docs.aws.amazon.com/AmazonS3/latest/API/RESTCommonResponseHeaders.html
           for more info
     Does not support buckets with versioning enabled
+
+    With ``use_manifest`` the state of the prefix after each sync is stored in a
+    gzipped manifest object at the prefix, and the next sync diffs against it
+    instead of listing the prefix. Objects changed in S3 by anything other than
+    taskcat are not noticed until the manifest expires or goes missing.
     """
 
     # TODO: better exclusions that support path wildcards, eg. "*/.git/*"
@@ -42,7 +51,27 @@ class S3Sync:
 
     exclude_remote_path_prefixes: List[str] = []
 
-    def __init__(self, s3_client, bucket, prefix, path, acl="private", dry_run=False):
+    # multipart settings are shared by the uploader and the local etag calculation,
+    # changing them only affects which files are considered changed on the next run
+    multipart_threshold = 8 * 1024 * 1024
+    multipart_chunksize = 8 * 1024 * 1024
+    max_concurrency = 16
+
+    # dot-prefixed, so it is excluded from both local and remote file lists
+    manifest_name = ".taskcat-sync-manifest.json.gz"
+    manifest_max_age = 24 * 60 * 60
+    manifest_version = 1
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        s3_client,
+        bucket,
+        prefix,
+        path,
+        acl="private",
+        dry_run=False,
+        use_manifest=False,
+    ):
         """Syncronizes local file system with an s3 bucket/prefix"""
         if prefix != "" and not prefix.endswith("/"):
             prefix = prefix + "/"
@@ -55,29 +84,48 @@ class S3Sync:
             + self.exclude_remote_path_prefixes,
         )
         file_list = self._get_local_file_list(path)
-        s3_file_list = self._get_s3_file_list(bucket, prefix)
-        self._sync(file_list, s3_file_list, bucket, prefix, acl=acl)
+        s3_file_list = None
+        if use_manifest:
+            s3_file_list = self._get_s3_manifest(bucket, prefix)
+        from_manifest = s3_file_list is not None
+        if not from_manifest:
+            s3_file_list = self._get_s3_file_list(bucket, prefix)
+        try:
+            changed = self._sync(file_list, s3_file_list, bucket, prefix, acl=acl)
+        except Exception:
+            # the remote state is unknown now, make sure the next run lists it
+            if use_manifest and not dry_run:
+                self._delete_s3_manifest(bucket, prefix)
+            raise
+        if use_manifest and not dry_run and (changed or not from_manifest):
+            self._put_s3_manifest(bucket, prefix, file_list)
 
     def _exclude_via_gitignore_syntax(self, file_path):
         return self.exclude_patterns.match_file(file_path)
 
-    @staticmethod
-    def _hash_file(file_path, chunk_size=8 * 1024 * 1024):
+    @classmethod
+    def _hash_file(cls, file_path, chunk_size=None):
         # This is a bit funky because of the way multipart upload etags are done, they
         # are a md5 of the md5's from each part with the number of parts appended
         # credit to hyperknot https://github.com/aws/aws-cli/issues/2585#issue-226758933
-        md5s = []
+        # The part size has to match the one the transfer manager will pick for the
+        # file, otherwise unchanged files would be re-uploaded on every sync.
+        file_size = os.path.getsize(file_path)
+        chunk_size = chunk_size if chunk_size else cls.multipart_chunksize
+
+        if file_size < cls.multipart_threshold:
+            file_md5 = hashlib.md5()  # nosec
+            with open(file_path, "rb") as file_handle:
+                for data in iter(partial(file_handle.read, chunk_size), b""):
+                    file_md5.update(data)
+            return '"{}"'.format(file_md5.hexdigest())
 
+        chunk_size = ChunksizeAdjuster().adjust_chunksize(chunk_size, file_size)
+        md5s = []
         with open(file_path, "rb") as file_handle:
-            while True:
-                data = file_handle.read(chunk_size)
-                if not data:
-                    break
+            for data in iter(partial(file_handle.read, chunk_size), b""):
                 md5s.append(hashlib.md5(data))  # nosec
 
-        if len(md5s) == 1:
-            return '"{}"'.format(md5s[0].hexdigest())
-
         digests = b"".join(m.digest() for m in md5s)
         digests_md5 = hashlib.md5(digests)  # nosec
         return '"{}-{}"'.format(digests_md5.hexdigest(), len(md5s))
@@ -151,12 +199,57 @@ class S3Sync:
                 is_paginated = False
         return objects
 
+    def _get_s3_manifest(self, bucket, prefix):
+        key = prefix + self.manifest_name
+        try:
+            resp = self.s3_client.get_object(Bucket=bucket, Key=key)
+            manifest = json.loads(gzip.decompress(resp["Body"].read()))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ["NoSuchKey", "AccessDenied"]:
+                raise
+            LOG.debug(f"no sync manifest at s3://{bucket}/{key}, listing objects")
+            return None
+        except (OSError, ValueError) as e:
+            LOG.warning(f"ignoring unreadable sync manifest s3://{bucket}/{key}: {e}")
+            return None
+        age = time.time() - manifest.get("generated", 0)
+        if (
+            manifest.get("version") != self.manifest_version
+            or age > self.manifest_max_age
+        ):
+            LOG.debug(f"sync manifest s3://{bucket}/{key} is stale, listing objects")
+            return None
+        return {relpath: etag for relpath, (etag, _) in manifest["objects"].items()}
+
+    def _put_s3_manifest(self, bucket, prefix, local_list):
+        objects = {
+            relpath: [checksum, os.path.getsize(full_path)]
+            for relpath, (full_path, checksum) in local_list.items()
+        }
+        manifest = {
+            "version": self.manifest_version,
+            "generated": int(time.time()),
+            "objects": objects,
+        }
+        self.s3_client.put_object(
+            Bucket=bucket,
+            Key=prefix + self.manifest_name,
+            Body=gzip.compress(json.dumps(manifest).encode("utf-8")),
+            ContentType="application/gzip",
+        )
+
+    def _delete_s3_manifest(self, bucket, prefix):
+        try:
+            self.s3_client.delete_object(Bucket=bucket, Key=prefix + self.manifest_name)
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.warning(f"failed to remove sync manifest from s3://{bucket}: {e}")
+
     def _exclude_remote(self, path):
         return self._exclude_via_gitignore_syntax(path)
 
     # TODO: refactor
     def _sync(  # noqa: C901
-        self, local_list, s3_list, bucket, prefix, acl, threads=16
+        self, local_list, s3_list, bucket, prefix, acl
     ):  # pylint: disable=too-many-locals
         # determine which files to remove from S3
         remove_from_s3 = []
@@ -200,46 +293,75 @@ class S3Sync:
                 absolute_path = local_list[local_file][0]
                 s3_path = local_file
                 upload_to_s3.append([absolute_path, bucket, s3_path])
-        # multithread the uploading of files
-        pool = ThreadPool(threads)
-        func = partial(
-            self._s3_upload_file, prefix=prefix, s3_client=self.s3_client, acl=acl
+        self._s3_upload_files(upload_to_s3, prefix, acl)
+        return bool(remove_from_s3 or upload_to_s3)
+
+    def _transfer_config(self):
+        return TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=self.multipart_chunksize,
+            max_concurrency=self.max_concurrency,
+            use_threads=True,
         )
-        pool.map(func, upload_to_s3)
-        pool.close()
-        pool.join()
 
-    def _s3_upload_file(self, paths, prefix, s3_client, acl):
-        local_filename, bucket, s3_path = paths
-        retry = 0
-        # backoff and retry
-        while retry < 5:
-            if self.dry_run:
+    def _s3_upload_files(self, upload_to_s3, prefix, acl):
+        if self.dry_run:
+            for _, bucket, s3_path in upload_to_s3:
                 LOG.info(
                     f"[DRY_RUN] s3://{bucket}/{prefix + s3_path}",
                     extra={"nametag": PrintMsg.S3},
                 )
-                break
-            LOG.info(
-                f"s3://{bucket}/{prefix + s3_path}", extra={"nametag": PrintMsg.S3}
-            )
-            try:
-                s3_client.upload_file(
-                    local_filename,
-                    bucket,
-                    prefix + s3_path,
-                    ExtraArgs={"ACL": acl},
-                    Config=TransferConfig(use_threads=False),
-                )
-                break
-            except Exception as e:  # pylint: disable=broad-except
-                retry += 1
-                LOG.error("S3 upload error: %s" % e)
-                # give up if we've exhausted retries, or if the error is not-retryable
-                # ie. AccessDenied
-                if retry == 5 or (
-                    isinstance(e, S3UploadFailedError) and "(AccessDenied)" in str(e)
-                ):
-                    # pylint: disable=raise-missing-from
-                    raise TaskCatException("Failed to upload to S3")
-                time.sleep(retry * 2)
+            return
+        if not upload_to_s3:
+            return
+        # largest files go first, so their parts are spread over the whole pool
+        # instead of trailing behind the small files at the end of the queue
+        pending = sorted(
+            upload_to_s3, key=lambda paths: os.path.getsize(paths[0]), reverse=True
+        )
+        total_bytes = sum(os.path.getsize(paths[0]) for paths in pending)
+        start = time.time()
+        self._s3_upload_with_retries(pending, prefix, acl)
+        elapsed = max(time.time() - start, 0.001)
+        LOG.info(
+            f"{len(upload_to_s3)} files, {total_bytes / 1024 / 1024:.1f} MiB in "
+            f"{elapsed:.1f}s ({total_bytes / 1024 / 1024 / elapsed:.1f} MiB/s)",
+            extra={"nametag": PrintMsg.S3},
+        )
+
+    def _s3_upload_with_retries(self, pending, prefix, acl):
+        retry = 0
+        # a single transfer manager bounds the number of in-flight requests across
+        # all files, whether they are whole small files or parts of large ones
+        with TransferManager(self.s3_client, self._transfer_config()) as manager:
+            # backoff and retry
+            while pending:
+                futures = [
+                    (paths, self._s3_upload_file(paths, prefix, manager, acl))
+                    for paths in pending
+                ]
+                pending = []
+                for paths, future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:  # pylint: disable=broad-except
+                        LOG.error("S3 upload error: %s" % e)
+                        # give up if the error is not-retryable ie. AccessDenied
+                        if (
+                            isinstance(e, (S3UploadFailedError, ClientError))
+                            and "(AccessDenied)" in str(e)
+                        ) or retry == 4:
+                            # pylint: disable=raise-missing-from
+                            raise TaskCatException("Failed to upload to S3")
+                        pending.append(paths)
+                if pending:
+                    retry += 1
+                    time.sleep(retry * 2)
+
+    @staticmethod
+    def _s3_upload_file(paths, prefix, manager, acl):
+        local_filename, bucket, s3_path = paths
+        LOG.info(f"s3://{bucket}/{prefix + s3_path}", extra={"nametag": PrintMsg.S3})
+        return manager.upload(
+            local_filename, bucket, prefix + s3_path, extra_args={"ACL": acl}
+        )
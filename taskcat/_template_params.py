@@ -1,20 +1,177 @@
 import logging
 import random
 import re
+import threading
+import time
 import uuid
-from typing import Set
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 import dulwich
 from dulwich.repo import Repo
 from taskcat._common_utils import (
     CommonTools,
     fetch_secretsmanager_parameter_value,
+    fetch_secretsmanager_parameter_values,
     fetch_ssm_parameter_value,
+    fetch_ssm_parameter_values,
 )
 from taskcat.exceptions import TaskCatException
 
 LOG = logging.getLogger(__name__)
 
+# (ZoneName, ZoneId) of the available zones, keyed by (account_id, region)
+_AZ_CACHE: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+_AZ_CACHE_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+_AZ_CACHE_LOCK = threading.Lock()
+
+# (expiry, value) of ssm parameters and secrets, keyed by (service, account_id,
+# region, name). Entries expire so a long-lived process picks up rotated values.
+PARAMETER_VALUE_CACHE_TTL = 5 * 60
+_PARAMETER_VALUE_CACHE: Dict[Tuple[str, str, str, str], Tuple[float, str]] = {}
+_PARAMETER_VALUE_CACHE_LOCK = threading.Lock()
+
+
+@dataclass(frozen=True)
+class RenderContext:
+    """
+    Where and how a set of parameters is rendered, beyond the template inputs.
+
+    :param account_id: account the region's client belongs to, used to share
+    availability zone and ssm/secret lookups; None disables sharing
+    :param random_seed: makes generated values reproducible for the same seed and
+    parameter name; None draws them at random
+    """
+
+    account_id: Optional[str] = None
+    random_seed: Optional[str] = None
+
+
+def _describe_availability_zones(boto_client) -> List[Tuple[str, str]]:
+    availability_zones = boto_client("ec2").describe_availability_zones(
+        Filters=[{"Name": "state", "Values": ["available"]}]
+    )
+    return [
+        (az["ZoneName"], az["ZoneId"]) for az in availability_zones["AvailabilityZones"]
+    ]
+
+
+def get_availability_zones(boto_client, account_id, region) -> List[Tuple[str, str]]:
+    """
+    Returns the (ZoneName, ZoneId) of each available zone in a region. Lookups are
+    cached for the life of the process per account and region, callers apply
+    their own exclusions.
+
+    :param boto_client: client factory for the region, eg. RegionObj.client
+    :param account_id: account the client belongs to, None disables caching
+    :param region: region name
+
+    :return: List of (ZoneName, ZoneId) tuples
+    """
+    if account_id is None:
+        return _describe_availability_zones(boto_client)
+    key = (str(account_id), region)
+    if key in _AZ_CACHE:
+        return _AZ_CACHE[key]
+    with _AZ_CACHE_LOCK:
+        lock = _AZ_CACHE_LOCKS.setdefault(key, threading.Lock())
+    with lock:
+        # another thread may have looked it up while we were waiting for the lock
+        if key not in _AZ_CACHE:
+            _AZ_CACHE[key] = _describe_availability_zones(boto_client)
+    return _AZ_CACHE[key]
+
+
+def prefill_availability_zones(region_objects: Iterable, max_workers: int = 16):
+    """
+    Looks up the availability zones of several regions concurrently, so that
+    rendering parameters afterwards is served from the cache.
+
+    :param region_objects: RegionObj-like objects (account_id, name and client)
+    :param max_workers: Maximum number of concurrent lookups
+    """
+    regions = {(r.account_id, r.name): r for r in region_objects}
+    if not regions:
+        return
+    with ThreadPoolExecutor(max_workers=min(len(regions), max_workers)) as pool:
+        futures = [
+            pool.submit(get_availability_zones, r.client, r.account_id, r.name)
+            for r in regions.values()
+        ]
+        for future in futures:
+            future.result()
+
+
+def clear_availability_zone_cache():
+    with _AZ_CACHE_LOCK:
+        _AZ_CACHE.clear()
+        _AZ_CACHE_LOCKS.clear()
+
+
+def _prefetch_region_values(region, ssm_paths, secret_ids):
+    account_region = (str(region.account_id), region.name)
+    values = {}
+    if ssm_paths:
+        ssm_values = fetch_ssm_parameter_values(region.client, ssm_paths)
+        for path, value in ssm_values.items():
+            values[("ssm",) + account_region + (path,)] = value
+    if secret_ids:
+        secret_values = fetch_secretsmanager_parameter_values(region.client, secret_ids)
+        for secret, value in secret_values.items():
+            values[("secretsmanager",) + account_region + (secret,)] = value
+    _cache_parameter_values(values)
+
+
+def _cache_parameter_values(values: Dict[Tuple[str, str, str, str], str]):
+    expiry = time.monotonic() + PARAMETER_VALUE_CACHE_TTL
+    with _PARAMETER_VALUE_CACHE_LOCK:
+        for key, value in values.items():
+            _PARAMETER_VALUE_CACHE[key] = (expiry, value)
+
+
+def _cached_parameter_value(key: Tuple[str, str, str, str]) -> Optional[str]:
+    with _PARAMETER_VALUE_CACHE_LOCK:
+        expiry, value = _PARAMETER_VALUE_CACHE.get(key, (0.0, None))
+    return value if expiry > time.monotonic() else None
+
+
+def prefetch_parameter_values(
+    region_params: Iterable[Tuple[Any, Dict[str, Any]]], max_workers: int = 16
+):
+    """
+    Resolves the ssm and secretsmanager references in the parameters of several
+    regions up front, a batch per region and regions concurrently, so that
+    rendering afterwards is served from the cache.
+
+    :param region_params: (RegionObj-like, parameter values) pairs
+    :param max_workers: Maximum number of regions fetched concurrently
+    """
+    references: Dict[Tuple[str, str], Tuple[Any, Set[str], Set[str]]] = {}
+    for region, param_dict in region_params:
+        ssm_paths, secret_ids = ParamGen.parameter_references(param_dict)
+        if not ssm_paths and not secret_ids:
+            continue
+        _, region_ssm, region_secrets = references.setdefault(
+            (region.account_id, region.name), (region, set(), set())
+        )
+        region_ssm.update(ssm_paths)
+        region_secrets.update(secret_ids)
+    if not references:
+        return
+    with ThreadPoolExecutor(max_workers=min(len(references), max_workers)) as pool:
+        futures = [
+            pool.submit(_prefetch_region_values, *region_references)
+            for region_references in references.values()
+        ]
+        for future in futures:
+            future.result()
+
+
+def clear_parameter_value_cache():
+    with _PARAMETER_VALUE_CACHE_LOCK:
+        _PARAMETER_VALUE_CACHE.clear()
+
 
 # pylint: disable=too-many-instance-attributes
 class ParamGen:
@@ -49,6 +206,32 @@ class ParamGen:
     RE_SECRETSMANAGER_PARAMETER = re.compile(
         r"\$\[taskcat_secretsmanager_.*]$", re.IGNORECASE
     )
+    RE_PLACEHOLDER = re.compile(r"\$\[([^\]]*)]")
+    RE_PLACEHOLDER_KIND = re.compile(
+        r"taskcat_(?:"
+        r"(?P<random_numbers>random-numbers)|"
+        r"(?P<random_string>random-string)|"
+        r"(?P<autobucket_prefix>autobucket_prefix)|"
+        r"(?P<autobucket>autobucket)|"
+        r"(?P<current_region>current_region)|"
+        r"(?P<project_name>project_name)|"
+        r"(?P<test_name>test_name)|"
+        r"(?P<git_branch>git_branch)|"
+        r"(?P<ssm>ssm_.*)|"
+        r"(?P<secretsmanager>secretsmanager_.*))|"
+        r"\w+_(?:"
+        r"(?P<genpass>genpass?\w_\d{1,2}\w?)|"
+        r"(?P<genaz>ge[nt]az_\d)|"
+        r"(?P<genaz_single>ge[nt]singleaz_\d+)|"
+        r"(?P<keypair>getkeypair)|"
+        r"(?P<license_bucket>getlicensebucket)|"
+        r"(?P<media_bucket>getmediabucket)|"
+        r"(?P<license_content>getlicensecontent)|"
+        r"(?P<presigned_url>presignedurl)|"
+        r"(?P<getval>getval_\w+)|"
+        r"(?P<uuid>gen[gu]uid))",
+        re.IGNORECASE,
+    )
 
     def __init__(
         self,
@@ -60,6 +243,7 @@ class ParamGen:
         project_name,
         test_name,
         az_excludes=None,
+        context: Optional[RenderContext] = None,
     ):
         self.regxfind = CommonTools.regxfind
         self._param_dict = param_dict
@@ -85,6 +269,12 @@ class ParamGen:
         self.project_name = project_name
         self.test_name = test_name
         self.project_root = project_root
+        context = context or RenderContext()
+        self.account_id = context.account_id
+        # with a seed, generated values only depend on the seed and the parameter
+        # name, not on the order (or thread) parameters get rendered in
+        self.random_seed = context.random_seed
+        self._random = None
         if not az_excludes:
             self.az_excludes: Set[str] = set()
         else:
@@ -110,6 +300,7 @@ class ParamGen:
                     self.project_name,
                     self.test_name,
                     self.az_excludes,
+                    RenderContext(self.account_id, self._param_seed(param_name)),
                 )
                 # nested_pg.transform_parameter()
                 for result_value in nested_pg.results.values():
@@ -121,69 +312,181 @@ class ParamGen:
             # Setting the instance variables to reflect key/value pair we're working on.
             self.param_name = param_name
             self.param_value = param_value
+            seed = self._param_seed(param_name)
+            self._random = random.Random(seed) if seed is not None else None
 
             # Convert from bytes to string.
             self.convert_to_str()
 
-            # $[taskcat_random-numbers]
-            self._regex_replace_param_value(self.RE_GENNUMB, self._gen_rand_num(20))
+            if isinstance(self.param_value, str) and "$[" in self.param_value:
+                self._replace_placeholders()
+            else:
+                # literals can still be referenced by $[taskcat_getval_*]
+                self.mutated_params[self.param_name] = self.param_value
 
-            # $[taskcat_random-string]
-            self._regex_replace_param_value(self.RE_GENRANDSTR, self._gen_rand_str(20))
+            self.results.update({self.param_name: self.param_value})
 
+    @classmethod
+    def needs_availability_zones(cls, param_dict) -> bool:
+        """
+        Returns True if any of the parameter values asks for availability zones.
+
+        :param param_dict: Parameter values, before rendering
+        """
+        for param_value in param_dict.values():
+            values = param_value if isinstance(param_value, list) else [param_value]
+            for value in values:
+                if isinstance(value, str) and (
+                    cls.RE_GENAZ.search(value) or cls.RE_GENAZ_SINGLE.search(value)
+                ):
+                    return True
+        return False
+
+    def _placeholder_kinds(self, param_value):
+        kinds = set()
+        for placeholder in self.RE_PLACEHOLDER.finditer(param_value):
+            kind = self.RE_PLACEHOLDER_KIND.fullmatch(placeholder.group(1))
+            if kind:
+                kinds.add(kind.lastgroup)
+        return kinds
+
+    def _placeholder_handlers(self):
+        # in the order they have always been applied, as some of them replace the
+        # whole value and the result of one can feed the next
+        return [
+            # $[taskcat_random-numbers]
+            (
+                "random_numbers",
+                lambda: self._regex_replace_param_value(
+                    self.RE_GENNUMB, self._gen_rand_num(20, self._random)
+                ),
+            ),
+            # $[taskcat_random-string]
+            (
+                "random_string",
+                lambda: self._regex_replace_param_value(
+                    self.RE_GENRANDSTR, self._gen_rand_str(20, self._random)
+                ),
+            ),
             # $[taskcat_autobucket]
-            self._regex_replace_param_value(
-                self.RE_GENAUTOBUCKET, self._gen_autobucket()
-            )
+            (
+                "autobucket",
+                lambda: self._regex_replace_param_value(
+                    self.RE_GENAUTOBUCKET, self._gen_autobucket()
+                ),
+            ),
             # $[taskcat_autobucket_prefix]
-            self._regex_replace_param_value(
-                self.RE_GENAUTOBUCKETPREFIX, self._get_autobucket_prefix()
-            )
-
+            (
+                "autobucket_prefix",
+                lambda: self._regex_replace_param_value(
+                    self.RE_GENAUTOBUCKETPREFIX, self._get_autobucket_prefix()
+                ),
+            ),
             # $[taskcat_genpass_X]
-            self._gen_password_wrapper(self.RE_GENPW, self.RE_PWTYPE, self.RE_COUNT)
-
+            (
+                "genpass",
+                lambda: self._gen_password_wrapper(
+                    self.RE_GENPW, self.RE_PWTYPE, self.RE_COUNT
+                ),
+            ),
             # $[taskcat_ge[nt]az_#]
-            self._gen_az_wrapper(self.RE_GENAZ, self.RE_COUNT)
-
+            ("genaz", lambda: self._gen_az_wrapper(self.RE_GENAZ, self.RE_COUNT)),
             # $[taskcat_ge[nt]singleaz_#]
-            self._gen_single_az_wrapper(self.RE_GENAZ_SINGLE)
-
+            (
+                "genaz_single",
+                lambda: self._gen_single_az_wrapper(self.RE_GENAZ_SINGLE),
+            ),
             # $[taskcat_getkeypair]
-            self._regex_replace_param_value(self.RE_QSKEYPAIR, "cikey")
-
+            (
+                "keypair",
+                lambda: self._regex_replace_param_value(self.RE_QSKEYPAIR, "cikey"),
+            ),
             # $[taskcat_getlicensebucket]
-            self._regex_replace_param_value(self.RE_QSLICBUCKET, "override_this")
-
+            (
+                "license_bucket",
+                lambda: self._regex_replace_param_value(
+                    self.RE_QSLICBUCKET, "override_this"
+                ),
+            ),
             # $[taskcat_getmediabucket]
-            self._regex_replace_param_value(self.RE_QSMEDIABUCKET, "override_this")
-
+            (
+                "media_bucket",
+                lambda: self._regex_replace_param_value(
+                    self.RE_QSMEDIABUCKET, "override_this"
+                ),
+            ),
             # $[taskcat_getlicensecontent]
-            self._get_license_content_wrapper(self.RE_GETLICCONTENT)
-
+            (
+                "license_content",
+                lambda: self._get_license_content_wrapper(self.RE_GETLICCONTENT),
+            ),
             # $[taskcat_getpresignedurl]
-            self._get_license_content_wrapper(self.RE_GETPRESIGNEDURL)
-
+            (
+                "presigned_url",
+                lambda: self._get_license_content_wrapper(self.RE_GETPRESIGNEDURL),
+            ),
             # $[taskcat_getval_X]
-            self._getval_wrapper(self.RE_GETVAL)
-
+            ("getval", lambda: self._getval_wrapper(self.RE_GETVAL)),
             # $[taskcat_genuuid]
-            self._regex_replace_param_value(self.RE_GENUUID, self._gen_uuid())
-
+            (
+                "uuid",
+                lambda: self._regex_replace_param_value(
+                    self.RE_GENUUID, self._gen_uuid()
+                ),
+            ),
             # $[taskcat_ssm_X]
-            self._get_ssm_param_value_wrapper(self.RE_SSM_PARAMETER)
+            (
+                "ssm",
+                lambda: self._get_ssm_param_value_wrapper(self.RE_SSM_PARAMETER),
+            ),
+            # $[taskcat_secretsmanager_X]
+            (
+                "secretsmanager",
+                lambda: self._get_secretsmanager_param_value_wrapper(
+                    self.RE_SECRETSMANAGER_PARAMETER
+                ),
+            ),
             # $[taskcat_current_region]
-            self._regex_replace_param_value(
-                self.RE_CURRENT_REGION, self._gen_current_region()
-            )
-            self._regex_replace_param_value(
-                self.RE_PROJECT_NAME, self._get_project_name()
-            )
-            self._regex_replace_param_value(self.RE_TEST_NAME, self._get_test_name())
+            (
+                "current_region",
+                lambda: self._regex_replace_param_value(
+                    self.RE_CURRENT_REGION, self._gen_current_region()
+                ),
+            ),
+            # $[taskcat_project_name]
+            (
+                "project_name",
+                lambda: self._regex_replace_param_value(
+                    self.RE_PROJECT_NAME, self._get_project_name()
+                ),
+            ),
+            # $[taskcat_test_name]
+            (
+                "test_name",
+                lambda: self._regex_replace_param_value(
+                    self.RE_TEST_NAME, self._get_test_name()
+                ),
+            ),
             # $[taskcat_git_branch]
-            self._git_branch_wrapper(self.RE_GITBRANCH)
+            ("git_branch", lambda: self._git_branch_wrapper(self.RE_GITBRANCH)),
+        ]
+
+    def _replace_placeholders(self):
+        # find the placeholders once and only run their handlers, the handlers
+        # still check their own pattern before replacing anything
+        kinds = self._placeholder_kinds(self.param_value)
+        for kind, handler in self._placeholder_handlers():
+            if kind not in kinds:
+                continue
+            param_value = self.param_value
+            handler()
+            if self.param_value != param_value:
+                kinds = self._placeholder_kinds(self.param_value)
 
-            self.results.update({self.param_name: self.param_value})
+    def _param_seed(self, param_name):
+        if self.random_seed is None:
+            return None
+        return f"{self.random_seed}:{param_name}"
 
     def get_available_azs(self, count):
         """
@@ -194,18 +497,13 @@ class ParamGen:
         :return: List of availability zones in a given region
 
         """
-        ec2_client = self._boto_client("ec2")
-        available_azs = []
-        availability_zones = ec2_client.describe_availability_zones(
-            Filters=[{"Name": "state", "Values": ["available"]}]
-        )
-
-        for az in availability_zones[  # pylint: disable=invalid-name
-            "AvailabilityZones"
-        ]:
-            if az["ZoneId"] in self.az_excludes:
-                continue
-            available_azs.append(az["ZoneName"])
+        available_azs = [
+            zone_name
+            for zone_name, zone_id in get_availability_zones(
+                self._boto_client, self.account_id, self.region
+            )
+            if zone_id not in self.az_excludes
+        ]
 
         if len(available_azs) < count:
             raise TaskCatException(
@@ -254,15 +552,17 @@ class ParamGen:
         return content
 
     @staticmethod
-    def genpassword(pass_length, pass_type=None):
+    def genpassword(pass_length, pass_type=None, rng=None):
         """
         Returns a password of given length and type.
 
         :param pass_length: Length of the desired password
         :param pass_type: Type of the desired password - String only OR Alphanumeric
             * A = AlphaNumeric, Example 'vGceIP8EHC'
+        :param rng: random.Random instance to draw from, defaults to the shared one
         :return: Password of given length and type
         """
+        choice = rng.choice if rng else random.choice
 
         password = []
         numbers = "1234567890"
@@ -275,27 +575,27 @@ class ParamGen:
         if pass_type == "A":  # nosec
 
             while len(password) < pass_length:
-                password.append(random.choice(lowercase))
-                password.append(random.choice(uppercase))
-                password.append(random.choice(numbers))
+                password.append(choice(lowercase))
+                password.append(choice(uppercase))
+                password.append(choice(numbers))
 
         # Generates password string with:
         # lowercase,uppercase, numbers and special chars
         elif pass_type == "S":
             while len(password) < pass_length:
-                password.append(random.choice(lowercase))
-                password.append(random.choice(uppercase))
-                password.append(random.choice(numbers))
-                password.append(random.choice(specialchars))
+                password.append(choice(lowercase))
+                password.append(choice(uppercase))
+                password.append(choice(numbers))
+                password.append(choice(specialchars))
         else:
             # If no passtype is defined (None)
             # Defaults to alpha-numeric
             # Generates password string with:
             # lowercase,uppercase, numbers and special chars
             while len(password) < pass_length:
-                password.append(random.choice(lowercase))
-                password.append(random.choice(uppercase))
-                password.append(random.choice(numbers))
+                password.append(choice(lowercase))
+                password.append(choice(uppercase))
+                password.append(choice(numbers))
 
         if len(password) > pass_length:
             password = password[:pass_length]
@@ -311,19 +611,21 @@ class ParamGen:
             self.param_value = str(self.param_value)
 
     @staticmethod
-    def _gen_rand_str(length):
+    def _gen_rand_str(length, rng=None):
+        choice = rng.choice if rng else random.choice
         random_string_list = []
         lowercase = "abcdefghijklmnopqrstuvwxyz"
         while len(random_string_list) < length:
-            random_string_list.append(random.choice(lowercase))  # nosec
+            random_string_list.append(choice(lowercase))  # nosec
         return "".join(random_string_list)
 
     @staticmethod
-    def _gen_rand_num(length):
+    def _gen_rand_num(length, rng=None):
+        choice = rng.choice if rng else random.choice
         random_number_list = []
         numbers = "1234567890"
         while len(random_number_list) < length:
-            random_number_list.append(random.choice(numbers))  # nosec
+            random_number_list.append(choice(numbers))  # nosec
         return "".join(random_number_list)
 
     @staticmethod
@@ -378,7 +680,7 @@ class ParamGen:
                 gentype = "D"
 
             if passlen:
-                param_value = self.genpassword(passlen, gentype)
+                param_value = self.genpassword(passlen, gentype, self._random)
                 self._regex_replace_param_value(gen_regex, param_value)
 
     def _git_branch_wrapper(self, git_branch_regex):
@@ -438,11 +740,51 @@ class ParamGen:
             self._regex_replace_param_value(re.compile("^.*$"), param_value)
             self._regex_replace_param_value(re.compile("^.*$"), param_value)
 
+    @staticmethod
+    def _reference_name(placeholder):
+        # "$[taskcat_ssm_/my/param_name]" -> "/my/param_name"
+        return "_".join(placeholder[:-1].split("_")[2:])
+
+    @classmethod
+    def parameter_references(cls, param_dict) -> Tuple[Set[str], Set[str]]:
+        """
+        Returns the ssm parameter paths and secretsmanager secret ids referenced
+        by the parameter values.
+
+        :param param_dict: Parameter values, before rendering
+        """
+        ssm_paths: Set[str] = set()
+        secret_ids: Set[str] = set()
+        for param_value in param_dict.values():
+            values = param_value if isinstance(param_value, list) else [param_value]
+            for value in values:
+                if not isinstance(value, str) or "$[" not in value:
+                    continue
+                ssm_match = cls.RE_SSM_PARAMETER.search(value)
+                if ssm_match:
+                    ssm_paths.add(cls._reference_name(ssm_match.group(0)))
+                secret_match = cls.RE_SECRETSMANAGER_PARAMETER.search(value)
+                if secret_match:
+                    secret_ids.add(cls._reference_name(secret_match.group(0)))
+        return ssm_paths, secret_ids
+
+    def _cached_value(self, service, name, fetch_func):
+        if self.account_id is None:
+            return fetch_func(self._boto_client, name)
+        key = (service, str(self.account_id), self.region, name)
+        value = _cached_parameter_value(key)
+        if value is None:
+            value = fetch_func(self._boto_client, name)
+            _cache_parameter_values({key: value})
+        return value
+
     def _get_ssm_param_value_wrapper(self, ssm_param_value_regex):
         if ssm_param_value_regex.search(self.param_value):
             ssm_value_str = self.regxfind(ssm_param_value_regex, self.param_value)
-            param_path = "_".join(ssm_value_str[:-1].split("_")[2:])
-            param_value = fetch_ssm_parameter_value(self._boto_client, param_path)
+            param_path = self._reference_name(ssm_value_str)
+            param_value = self._cached_value(
+                "ssm", param_path, fetch_ssm_parameter_value
+            )
             self._regex_replace_param_value(re.compile("^.*"), param_value)
 
     def _get_secretsmanager_param_value_wrapper(self, secretsmanager_param_value_regex):
@@ -450,9 +792,9 @@ class ParamGen:
             sm_value_str = self.regxfind(
                 secretsmanager_param_value_regex, self.param_value
             )
-            sm_arn = "_".join(sm_value_str.split("_")[2:])
-            param_value = fetch_secretsmanager_parameter_value(
-                self._boto_client, sm_arn
+            sm_arn = self._reference_name(sm_value_str)
+            param_value = self._cached_value(
+                "secretsmanager", sm_arn, fetch_secretsmanager_parameter_value
             )
             self._regex_replace_param_value(re.compile("^.*"), param_value)
 
@@ -7,6 +7,7 @@ from taskcat._cfn._log_stack_events import _CfnLogTools
 from taskcat._cfn.threaded import Stacker
 from taskcat._cfn_lint import Lint as TaskCatLint
 from taskcat._client_factory import Boto3Cache
+from taskcat._common_utils import determine_profile_for_region
 from taskcat._config import Config
 from taskcat._generate_reports import ReportBuilder
 from taskcat._lambda_build import LambdaBuild
@@ -19,6 +20,8 @@ from .base_test import BaseTest
 
 LOG = logging.getLogger(__name__)
 
+PREWARM_SERVICES = ["cloudformation", "s3", "ec2", "ssm"]
+
 
 class CFNTest(BaseTest):  # pylint: disable=too-many-instance-attributes
     """
@@ -79,6 +82,9 @@ class CFNTest(BaseTest):  # pylint: disable=too-many-instance-attributes
         _trim_tests(self.test_names, self.config)
 
         boto3_cache = Boto3Cache()
+        # clients get built in the background while templates load, lint runs and
+        # lambdas are packaged
+        _prewarm_clients(boto3_cache, self.config)
 
         templates = self.config.get_templates()
 
@@ -102,7 +108,11 @@ class CFNTest(BaseTest):  # pylint: disable=too-many-instance-attributes
                 LambdaBuild(self.config, self.config.project_root)
             # 3. s3 sync
             stage_in_s3(
-                buckets, self.config.config.project.name, self.config.project_root, []
+                buckets,
+                self.config.config.project.name,
+                self.config.project_root,
+                [],
+                use_manifest=self.config.config.project.s3_sync_manifest,
             )
         regions = self.config.get_regions(boto3_cache)
         parameters = self.config.get_rendered_parameters(buckets, regions, templates)
@@ -201,6 +211,16 @@ class CFNTest(BaseTest):  # pylint: disable=too-many-instance-attributes
         ).generate_report()
 
 
+def _prewarm_clients(boto3_cache, config):
+    regions_by_profile = {}
+    for test in config.config.tests.values():
+        for region in (test.regions or []) + (test.artifact_regions or []):
+            profile = determine_profile_for_region(test.auth or {}, region)
+            regions_by_profile.setdefault(profile, set()).add(region)
+    for profile, regions in regions_by_profile.items():
+        boto3_cache.prewarm([profile], sorted(regions), PREWARM_SERVICES)
+
+
 def _trim_regions(regions, config):
     if regions != "ALL":
         for test in config.config.tests.values():
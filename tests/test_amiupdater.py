@@ -1,6 +1,7 @@
 import logging
 import re
 import tempfile
+import time
 import unittest
 from datetime import datetime
 from pathlib import Path
@@ -12,6 +13,7 @@ from taskcat._amiupdater import (
     AMIUpdaterFatalException,
     Config as AUConfig,
     EC2FilterValue,
+    ImageCache,
     RegionalCodename,
     Template,
     _construct_filters,
@@ -744,6 +746,109 @@ class TestAMIUpdater(unittest.TestCase):
         expected = [{"api_results": [], "cn": "MOCK_CN", "region": "us-east-1"}]
         self.assertEqual(actual, expected)
 
+    def test_query_codenames_batches_per_region(self):
+        def codename(region, cn, name, owner="amazon"):
+            return RegionalCodename(
+                region=region,
+                cn=cn,
+                filters=[
+                    EC2FilterValue("name", [name]),
+                    EC2FilterValue("owner-alias", [owner]),
+                    EC2FilterValue("state", ["available"]),
+                ],
+            )
+
+        images = [
+            {"ImageId": "ami-1", "Name": "amzn2-ami-hvm-2.0-x86_64-gp2"},
+            {"ImageId": "ami-2", "Name": "amzn-ami-hvm-2018.03.0.1-x86_64-gp2"},
+            {"ImageId": "ami-3", "Name": "amzn-ami-hvm-2018.03.0.1-x86_64-gp2x"},
+        ]
+        regions = {}
+        for region in ["us-east-1", "us-west-2"]:
+            m_region = Mock()
+            m_region.client.return_value.describe_images.return_value = {
+                "Images": images
+            }
+            regions[region] = m_region
+        codenames = set()
+        for region in regions:
+            codenames.add(codename(region, "AMZNLINUX2", "amzn2-ami-hvm-*-x86_64-gp2"))
+            codenames.add(
+                codename(region, "AMZNLINUX", "amzn-ami-hvm-????.??.?.*-x86_64-gp2")
+            )
+            codenames.add(codename(region, "MARKETPLACE", "CentOS*", "marketplace"))
+
+        actual = query_codenames(codenames, regions)
+
+        for region, m_region in regions.items():
+            calls = m_region.client.return_value.describe_images.call_args_list
+            self.assertEqual(2, len(calls))
+            amazon = [
+                c
+                for c in calls
+                if {"Name": "owner-alias", "Values": ["amazon"]} in c[1]["Filters"]
+            ]
+            self.assertEqual(1, len(amazon))
+            self.assertIn(
+                {
+                    "Name": "name",
+                    "Values": [
+                        "amzn-ami-hvm-????.??.?.*-x86_64-gp2",
+                        "amzn2-ami-hvm-*-x86_64-gp2",
+                    ],
+                },
+                amazon[0][1]["Filters"],
+            )
+        results = {(r["region"], r["cn"]): r["api_results"] for r in actual}
+        self.assertEqual(6, len(results))
+        self.assertEqual([images[0]], results[("us-east-1", "AMZNLINUX2")])
+        self.assertEqual([images[1]], results[("us-west-2", "AMZNLINUX")])
+        self.assertEqual([], results[("us-east-1", "MARKETPLACE")])
+
+    def test_query_codenames_image_cache(self):
+        regional_cn = RegionalCodename(
+            region="us-east-1",
+            cn="AMZNLINUX2",
+            filters=[
+                EC2FilterValue("name", ["amzn2-ami-hvm-*-x86_64-gp2"]),
+                EC2FilterValue("owner-alias", ["amazon"]),
+            ],
+        )
+        images = [
+            {
+                "ImageId": "ami-1",
+                "Name": "amzn2-ami-hvm-2.0-x86_64-gp2",
+                "CreationDate": "2018-06-22T22:26:53.000Z",
+                "Description": "not cached",
+            }
+        ]
+        m_region = Mock(account_id="123456789012")
+        m_describe = m_region.client.return_value.describe_images
+        m_describe.return_value = {"Images": images}
+        cache_path = Path(tempfile.mkdtemp()) / "ami_images.json"
+
+        def query(**kwargs):
+            image_cache = ImageCache(cache_path, **kwargs)
+            return query_codenames({regional_cn}, {"us-east-1": m_region}, image_cache)
+
+        self.assertEqual(images, query()[0]["api_results"])
+        self.assertEqual(1, m_describe.call_count)
+        cached = query()
+        self.assertEqual(1, m_describe.call_count)
+        self.assertEqual(
+            [{k: images[0][k] for k in ["ImageId", "Name", "CreationDate"]}],
+            cached[0]["api_results"],
+        )
+        self.assertEqual("ami-1", reduce_api_results(cached)[0].ami_id)
+
+        query(refresh=True)
+        self.assertEqual(2, m_describe.call_count)
+        query(ttl=0)
+        self.assertEqual(3, m_describe.call_count)
+        with patch("taskcat._amiupdater.time.time", return_value=time.time() + 10**6):
+            query()
+        self.assertEqual(4, m_describe.call_count)
+
     def test_reduce_api_results(self):
         sample_raw_results = [
             {
@@ -759,11 +864,33 @@ class TestAMIUpdater(unittest.TestCase):
         self.assertEqual(result.creation_date, 1543439291)
         self.assertEqual(result.region, "us-east-1")
 
+    def test_reduce_api_results_streams_newest_per_key(self):
+        def results():
+            for region in ["us-east-1", "us-west-2"]:
+                images = [
+                    {
+                        "ImageId": f"ami-{region}-{day}",
+                        "CreationDate": f"2020-01-{day:02d}T00:00:00.000Z",
+                    }
+                    for day in [3, 17, 9, 17, 1]
+                ]
+                yield {"region": region, "cn": "MOCK_CN", "api_results": images}
+            yield {"region": "us-east-1", "cn": "MISSING", "api_results": []}
+
+        actual = reduce_api_results(results())
+        self.assertEqual(
+            [("us-east-1", "ami-us-east-1-17"), ("us-west-2", "ami-us-west-2-17")],
+            sorted((r.region, r.ami_id) for r in actual),
+        )
+        self.assertEqual(1579219200, actual[0].creation_date)
+
     def test__image_timestamp(self):
         sample_timestamp = "2018-06-22T22:26:53.000Z"
         expected_value = 1529706413
         actual_value = _image_timestamp(sample_timestamp)
         self.assertEqual(expected_value, actual_value)
+        self.assertEqual(expected_value, _image_timestamp("2018-06-23T00:26:53+02:00"))
+        self.assertEqual(expected_value, _image_timestamp("June 22 2018 22:26:53 UTC"))
 
     def test_construct_filters(self):
         example_config_obj = AUConfig
@@ -965,7 +1092,30 @@ class TestAMIUpdater(unittest.TestCase):
         AMIUpdater(sentinel.config)
         mock_config.load.assert_called_once()
         mock_det_templates.assert_called_once()
-        mock_get_regions.assert_called_once()
+        mock_get_regions.assert_not_called()
+
+    @patch("taskcat._amiupdater.AMIUpdater._determine_templates", autospec=True)
+    @patch("taskcat._amiupdater.Config", autospec=True)
+    def test_amiupdater_get_regions_only_builds_required(self, *_):
+        m_config = Mock()
+        m_config.config.general.auth = {"default": "main", "eu-west-1": "other"}
+        updater = AMIUpdater(m_config)
+        updater.boto3_cache = Mock()
+        updater.boto3_cache.client.return_value.describe_regions.return_value = {
+            "Regions": [{"RegionName": "us-east-1"}, {"RegionName": "us-west-2"}]
+        }
+
+        regions = updater._get_regions({"us-east-1", "eu-west-1", "ap-east-1"})
+
+        self.assertEqual({"us-east-1", "eu-west-1"}, set(regions))
+        self.assertEqual("main", regions["us-east-1"].profile)
+        self.assertEqual("other", regions["eu-west-1"].profile)
+        updater.boto3_cache.client.return_value.describe_regions.assert_called_once()
+
+        updater.boto3_cache.reset_mock()
+        regions = updater._get_regions({"eu-west-1"})
+        self.assertEqual(["eu-west-1"], list(regions))
+        updater.boto3_cache.client.assert_not_called()
 
     def test_amiupdater_commit_needed_exception(self):
         e = AMIUpdaterCommitNeededException("foobar")
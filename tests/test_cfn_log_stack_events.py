@@ -0,0 +1,59 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from taskcat._cfn._log_stack_events import _CfnLogTools
+
+
+def make_stack(name, status="CREATE_COMPLETE", descendants=(), launch_exception=None):
+    event = mock.Mock(
+        timestamp="2020-01-01 00:00:00",
+        status=status,
+        type="AWS::CloudFormation::Stack",
+        logical_id=name,
+        status_reason="" if status == "CREATE_COMPLETE" else f"{name} failed",
+    )
+    stack = mock.Mock(region_name="us-east-1", launch_exception=launch_exception)
+    stack.name = name
+    stack.status_reason = f"{name} could not launch"
+    stack.events.return_value = [event]
+    stack.descendants.return_value = list(descendants)
+    return stack
+
+
+class TestCfnLogTools(unittest.TestCase):
+    def test_createcfnlogs(self):
+        grandchild = make_stack("GrandChild", "CREATE_FAILED")
+        child = make_stack("Child", descendants=[grandchild])
+        root = make_stack("Root", descendants=[child, grandchild])
+        other = make_stack("Other", launch_exception=Exception())
+        logpath = Path(tempfile.mkdtemp())
+
+        _CfnLogTools().createcfnlogs(
+            mock.Mock(stacks=[root, other]), logpath, max_workers=2
+        )
+
+        self.assertEqual(
+            ["Other-us-east-1-cfnlogs.txt", "Root-us-east-1-cfnlogs.txt"],
+            sorted(p.name for p in logpath.iterdir()),
+        )
+        content = (logpath / "Root-us-east-1-cfnlogs.txt").read_text()
+        self.assertEqual(
+            ["Root", "Child", "GrandChild"],
+            [
+                line.split(": ")[1]
+                for line in content.splitlines()
+                if line.startswith("StackName: ")
+            ],
+        )
+        self.assertIn("Stack launch was successful", content)
+        self.assertIn("GrandChild failed", content)
+        root.descendants.assert_called_once_with(refresh=True)
+        child.descendants.assert_not_called()
+        for stack in [root, child, grandchild]:
+            stack.events.assert_called_once_with(refresh=True)
+        self.assertEqual(
+            "Other could not launch",
+            (logpath / "Other-us-east-1-cfnlogs.txt").read_text(),
+        )
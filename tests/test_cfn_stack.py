@@ -589,3 +589,10 @@ class TestStack(unittest.TestCase):
 
         desc = stack.descendants()
         self.assertEqual(len(desc), 2)
+
+        with mock.patch.object(
+            Stack, "_fetch_children", side_effect=AssertionError
+        ) as m_fetch:
+            desc = stack.descendants(refresh=True)
+        self.assertEqual(len(desc), 2)
+        m_fetch.assert_not_called()
@@ -1,21 +1,50 @@
+import tempfile
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from unittest import mock
 
-import boto3
+import botocore.loaders as boto_loader
 from botocore.exceptions import ClientError, NoCredentialsError, ProfileNotFound
 
-from taskcat._client_factory import Boto3Cache
+from taskcat._client_factory import Boto3Cache, _endpoint_resolver
 from taskcat.exceptions import TaskCatException
 
 
 class TestBoto3Cache(unittest.TestCase):
     @mock.patch("taskcat._client_factory.boto3", autospec=True)
     def test_stable_concurrency(self, mock_boto3):
-        # Sometimes boto fails with KeyErrors under high concurrency
-        for key_error in ["endpoint_resolver", "credential_provider"]:
-            mock_boto3.Session.side_effect = [KeyError(key_error), mock.DEFAULT]
-            c = Boto3Cache(_boto3=mock_boto3)
-            c.session("default")
+        # concurrent first access must build each session and client exactly once
+        def slow_client(*args, **kwargs):
+            time.sleep(0.01)
+            return mock.Mock()
+
+        mock_boto3.Session.return_value.client.side_effect = slow_client
+        c = Boto3Cache(_boto3=mock_boto3)
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            futures = [
+                executor.submit(c.client, service, "default", region)
+                for _ in range(8)
+                for service in ["s3", "ec2"]
+                for region in ["us-east-1", "us-west-2"]
+            ]
+            clients = [future.result() for future in futures]
+        self.assertEqual(4, len({id(client) for client in clients}))
+        self.assertEqual(2, mock_boto3.Session.call_count)
+        self.assertEqual(4, mock_boto3.Session.return_value.client.call_count)
+
+    @mock.patch("taskcat._client_factory.boto3", autospec=True)
+    def test_prewarm(self, mock_boto3):
+        mock_boto3.Session.return_value.client.side_effect = lambda *a, **k: mock.Mock()
+        c = Boto3Cache(_boto3=mock_boto3)
+        futures = c.prewarm(["default"], ["us-east-1", "eu-west-1"], ["s3", "ec2"])
+        self.assertEqual(4, len(futures))
+        for future in futures:
+            future.result()
+        self.assertEqual(4, mock_boto3.Session.return_value.client.call_count)
+        c.client("s3", "default", "eu-west-1")
+        self.assertEqual(4, mock_boto3.Session.return_value.client.call_count)
 
     @mock.patch("taskcat._client_factory.Boto3Cache._cache_set", autospec=True)
     @mock.patch("taskcat._client_factory.Boto3Cache._cache_lookup", autospec=True)
@@ -67,6 +96,26 @@ class TestBoto3Cache(unittest.TestCase):
         self.assertEqual(mock__get_region.called, True)
         self.assertEqual(mock__get_endpoint_url.called, True)
 
+    def test__get_endpoint_url(self):
+        Boto3Cache._get_endpoint_url.cache_clear()
+        with mock.patch(
+            "taskcat._client_factory.boto_loader.create_loader",
+            wraps=boto_loader.create_loader,
+        ) as m_create_loader:
+            _endpoint_resolver.cache_clear()
+            for _ in range(3):
+                self.assertEqual(
+                    "https://sts.cn-north-1.amazonaws.com.cn",
+                    Boto3Cache._get_endpoint_url("sts", "cn-north-1"),
+                )
+                self.assertEqual(
+                    "https://sts.us-west-2.amazonaws.com",
+                    Boto3Cache._get_endpoint_url("sts", "us-west-2"),
+                )
+            m_create_loader.assert_called_once()
+        info = Boto3Cache._get_endpoint_url.cache_info()
+        self.assertEqual((4, 2), (info.hits, info.misses))
+
     @mock.patch("taskcat._client_factory.Boto3Cache._get_region", autospec=True)
     @mock.patch("taskcat._client_factory.Boto3Cache._cache_lookup", autospec=True)
     @mock.patch("taskcat._client_factory.Boto3Cache.session", autospec=True)
@@ -86,92 +135,140 @@ class TestBoto3Cache(unittest.TestCase):
         Boto3Cache().account_id()
         self.assertEqual(mock_cache_lookup.called, True)
 
-    @mock.patch("taskcat._client_factory.boto3", autospec=True)
-    @mock.patch("taskcat._client_factory.Boto3Cache._get_partition", autospec=True)
-    @mock.patch("taskcat._client_factory.Boto3Cache._get_region", autospec=True)
-    @mock.patch("taskcat._client_factory.Boto3Cache.session")
-    def test__get_account_info(
-        self, mock_session, mock__get_region, mock__get_partition, mock_boto3
-    ):
-        mock__get_region.return_value = "us-east-1"
-        session = boto3.Session()
-        session.get_available_regions = mock.Mock()
-        session.client = mock.Mock()
-        sts = mock.Mock()
-        sts.get_caller_identity.return_value = {"Account": "123412341234"}
-        session.client.return_value = sts
-        mock_session.return_value = session
-        mock_boto3.session.Session = mock.Mock()
-        mock_boto3.session.Session.return_value = session
-        cache = Boto3Cache(_boto3=mock_boto3)
-
-        mock__get_partition.return_value = ("aws-us-gov", "us-gov-east-1")
-        partition = cache._get_account_info("default")["partition"]
-        self.assertEqual(partition, "aws-us-gov")
+    @mock.patch("taskcat._client_factory.Boto3Cache._probe_partitions", autospec=True)
+    def test__get_account_info(self, mock__probe_partitions):
+        cache = Boto3Cache(identity_cache_path=None)
 
-        mock__get_partition.return_value = ("aws-cn", "cn-north-1")
-        partition = cache._get_account_info("default")["partition"]
-        self.assertEqual(partition, "aws-cn")
+        for partition, region in Boto3Cache.PARTITION_REGIONS:
+            mock__probe_partitions.return_value = (partition, region, "123412341234")
+            self.assertEqual(
+                {"partition": partition, "account_id": "123412341234"},
+                cache._get_account_info("default"),
+            )
+        # the probe's own response supplies the account id
+        self.assertEqual(3, mock__probe_partitions.call_count)
 
-        mock__get_partition.return_value = ("aws", "us-east-1")
-        partition = cache._get_account_info("default")["partition"]
-        self.assertEqual(partition, "aws")
-
-        self.assertEqual(3, sts.get_caller_identity.call_count)
-
-        sts.get_caller_identity.side_effect = ClientError(
+        mock__probe_partitions.side_effect = ClientError(
             error_response={"Error": {"Code": "test"}}, operation_name="test"
         )
         with self.assertRaises(ClientError):
             cache._get_account_info("default")
 
-        sts.get_caller_identity.side_effect = ClientError(
+        mock__probe_partitions.side_effect = ClientError(
             error_response={"Error": {"Code": "AccessDenied"}}, operation_name="test"
         )
         with self.assertRaises(TaskCatException):
             cache._get_account_info("default")
 
-        sts.get_caller_identity.side_effect = NoCredentialsError()
+        mock__probe_partitions.side_effect = NoCredentialsError()
         with self.assertRaises(TaskCatException):
             cache._get_account_info("default")
 
-        sts.get_caller_identity.side_effect = ProfileNotFound(
+        mock__probe_partitions.side_effect = ProfileNotFound(
             profile="non-existent_profile"
         )
         with self.assertRaises(TaskCatException):
             cache._get_account_info("default")
 
-    @mock.patch("taskcat._client_factory.boto3", autospec=True)
-    @mock.patch("taskcat._client_factory.Boto3Cache.session")
-    def test__get_partition(self, mock_session, mock_boto3):
-        session = boto3.Session()
-        session.client = mock.Mock()
-        sts = mock.Mock()
-        sts.get_caller_identity.return_value = {"Account": "123412341234"}
-        session.client.return_value = sts
-        mock_session.return_value = session
-        mock_boto3.session.Session = mock.Mock()
-        mock_boto3.session.Session.return_value = session
-        cache = Boto3Cache(_boto3=mock_boto3)
-
+    @mock.patch("taskcat._client_factory.Boto3Cache._configured_region", autospec=True)
+    @mock.patch("taskcat._client_factory.Boto3Cache.session", autospec=True)
+    @mock.patch("taskcat._client_factory.Boto3Cache.client", autospec=True)
+    def test__get_partition(self, mock_client, mock_session, mock_configured_region):
         invalid_token_exception = ClientError(
             error_response={"Error": {"Code": "InvalidClientTokenId"}},
             operation_name="test",
         )
+        regional_sts = {
+            "us-east-1": mock.Mock(),
+            "cn-north-1": mock.Mock(),
+            "us-gov-west-1": mock.Mock(),
+        }
+        for region, sts in regional_sts.items():
+            sts.get_caller_identity.return_value = {"Account": region}
+        mock_client.side_effect = lambda _self, _svc, _profile, region: regional_sts[
+            region
+        ]
+        session = mock_session.return_value
+        session.client.side_effect = lambda _svc, region_name, **_: regional_sts[
+            region_name
+        ]
+        mock_configured_region.return_value = "us-west-2"
+        cache = Boto3Cache()
 
-        sts.get_caller_identity.side_effect = [True]
-        result = cache._get_partition("default")
-        self.assertEqual(result, ("aws", "us-east-1"))
+        self.assertEqual(cache._get_partition("default"), ("aws", "us-east-1"))
+        self.assertEqual(
+            cache._probe_partitions("default"), ("aws", "us-east-1", "us-east-1")
+        )
+        # the other partitions aren't probed once the preferred one answers
+        self.assertEqual(regional_sts["cn-north-1"].get_caller_identity.call_count, 0)
+        self.assertEqual(
+            regional_sts["us-gov-west-1"].get_caller_identity.call_count, 0
+        )
 
-        sts.get_caller_identity.side_effect = [invalid_token_exception, True]
+        regional_sts["us-east-1"].get_caller_identity.side_effect = (
+            invalid_token_exception
+        )
         result = cache._get_partition("default")
         self.assertEqual(result, ("aws-cn", "cn-north-1"))
+        # the fallback probes share the preferred partition's session
+        self.assertEqual(
+            {call.args[1:] for call in mock_session.call_args_list},
+            {("default", "us-east-1")},
+        )
 
-        sts.get_caller_identity.side_effect = [
-            invalid_token_exception,
-            invalid_token_exception,
-            True,
-        ]
+        regional_sts["cn-north-1"].get_caller_identity.side_effect = (
+            invalid_token_exception
+        )
         result = cache._get_partition("default")
         self.assertEqual(result, ("aws-us-gov", "us-gov-west-1"))
-        self.assertEqual(sts.get_caller_identity.call_count, 6)
+
+        regional_sts["us-gov-west-1"].get_caller_identity.side_effect = (
+            invalid_token_exception
+        )
+        with self.assertRaises(ValueError):
+            cache._get_partition("default")
+
+        for sts in regional_sts.values():
+            sts.get_caller_identity.reset_mock()
+        mock_configured_region.return_value = "cn-northwest-1"
+        regional_sts["cn-north-1"].get_caller_identity.side_effect = None
+        self.assertEqual(cache._get_partition("default"), ("aws-cn", "cn-north-1"))
+        self.assertEqual(regional_sts["us-east-1"].get_caller_identity.call_count, 0)
+
+    @mock.patch("taskcat._client_factory.Boto3Cache.client", autospec=True)
+    @mock.patch("taskcat._client_factory.boto3", autospec=True)
+    def test__get_account_info_identity_cache(self, mock_boto3, mock_client):
+        mock_boto3.session.Session.return_value.region_name = "us-east-1"
+        sts = mock_client.return_value
+        sts.get_caller_identity.return_value = {"Account": "123412341234"}
+        credentials = mock_boto3.Session.return_value.get_credentials.return_value
+        credentials.access_key = "AKIAEXAMPLE"
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_path = Path(tmpdir) / "identity.json"
+            expected = {"partition": "aws", "account_id": "123412341234"}
+
+            first = Boto3Cache(_boto3=mock_boto3, identity_cache_path=cache_path)
+            self.assertEqual(expected, first._get_account_info("default"))
+            self.assertNotIn("AKIAEXAMPLE", cache_path.read_text())
+            # credentials come from the cached session, not a throwaway one
+            first._credential_fingerprint("default")
+            self.assertEqual(1, mock_boto3.Session.call_count)
+            self.assertIs(
+                mock_boto3.Session.return_value, first.session("default", "us-east-1")
+            )
+
+            second = Boto3Cache(_boto3=mock_boto3, identity_cache_path=cache_path)
+            self.assertEqual(expected, second._get_account_info("default"))
+            self.assertEqual(1, sts.get_caller_identity.call_count)
+
+            credentials.access_key = "AKIAOTHERKEY"
+            third = Boto3Cache(_boto3=mock_boto3, identity_cache_path=cache_path)
+            third._get_account_info("default")
+            self.assertEqual(2, sts.get_caller_identity.call_count)
+
+            later = time.time() + Boto3Cache.IDENTITY_CACHE_TTL + 1
+            with mock.patch("taskcat._client_factory.time.time", return_value=later):
+                expired = Boto3Cache(_boto3=mock_boto3, identity_cache_path=cache_path)
+                expired._get_account_info("default")
+            self.assertEqual(3, sts.get_caller_identity.call_count)
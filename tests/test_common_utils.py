@@ -3,9 +3,15 @@ import os
 import unittest
 from unittest import mock
 
+from botocore.exceptions import ClientError, ParamValidationError
+
 from taskcat._common_utils import (
+    cache_bucket_region,
+    clear_bucket_region_cache,
     exit_with_code,
+    fetch_secretsmanager_parameter_values,
     fetch_ssm_parameter_value,
+    fetch_ssm_parameter_values,
     get_s3_domain,
     make_dir,
     merge_dicts,
@@ -37,6 +43,7 @@ class TestCommonUtils(unittest.TestCase):
 
     @mock.patch("taskcat._common_utils.get_s3_domain", return_value="amazonaws.com")
     def test_s3_url_maker(self, m_get_s3_domain):
+        clear_bucket_region_cache()
         m_s3 = mock.Mock()
         m_s3.get_bucket_location.return_value = {"LocationConstraint": None}
         actual = s3_url_maker("test-bucket", "test-key/1", m_s3)
@@ -44,6 +51,7 @@ class TestCommonUtils(unittest.TestCase):
         self.assertEqual(
             "https://test-bucket.s3.us-east-1.amazonaws.com/test-key/1", actual
         )
+        clear_bucket_region_cache()
         m_s3.get_bucket_location.return_value = {"LocationConstraint": "us-west-2"}
 
         actual = s3_url_maker("test-bucket", "test-key/1", m_s3)
@@ -52,6 +60,25 @@ class TestCommonUtils(unittest.TestCase):
         )
         m_get_s3_domain.assert_called_once()
 
+    def test_s3_url_maker_caches_region(self):
+        clear_bucket_region_cache()
+        m_s3 = mock.Mock()
+        m_s3.get_bucket_location.return_value = {"LocationConstraint": "eu-west-1"}
+        for key in ["a", "b"]:
+            actual = s3_url_maker("test-bucket", key, m_s3)
+            self.assertEqual(
+                f"https://test-bucket.s3.eu-west-1.amazonaws.com/{key}", actual
+            )
+        m_s3.get_bucket_location.assert_called_once()
+
+        cache_bucket_region("created-bucket", "cn-north-1")
+        actual = s3_url_maker("created-bucket", "key", m_s3)
+        self.assertEqual(
+            "https://created-bucket.s3.cn-north-1.amazonaws.com.cn/key", actual
+        )
+        m_s3.get_bucket_location.assert_called_once()
+        clear_bucket_region_cache()
+
     def test_get_s3_domain(self):
         actual = get_s3_domain("cn-north-1")
         self.assertEqual("amazonaws.com.cn", actual)
@@ -132,3 +159,62 @@ class TestCommonUtils(unittest.TestCase):
         expected = "bar,baz,11"
         actual = fetch_ssm_parameter_value(m_boto_client, "foo")
         self.assertEqual(expected, actual)
+
+    def test_fetch_ssm_parameter_values(self):
+        m_boto_client = mock.Mock()
+        m_ssm = m_boto_client.return_value
+        paths = [f"/param/{i:02}" for i in range(25)] + ["/param/00"]
+
+        def get_parameters(Names):
+            if "/param/20" in Names:
+                raise ClientError({"Error": {"Code": "AccessDenied"}}, "GetParameters")
+            return {
+                "Parameters": [
+                    {"Name": name, "Value": f"value{name}"}
+                    for name in Names
+                    if name != "/param/05"
+                ]
+            }
+
+        m_ssm.get_parameters.side_effect = get_parameters
+        actual = fetch_ssm_parameter_values(m_boto_client, paths)
+        self.assertEqual(3, m_ssm.get_parameters.call_count)
+        self.assertEqual(
+            {p: f"value{p}" for p in sorted(set(paths))[:20] if p != "/param/05"},
+            actual,
+        )
+
+    def test_fetch_secretsmanager_parameter_values(self):
+        m_boto_client = mock.Mock()
+        m_secrets = m_boto_client.return_value
+        arn = "arn:aws:secretsmanager:us-east-1:123456789012:secret:two-AbCdEf"
+        m_secrets.batch_get_secret_value.return_value = {
+            "SecretValues": [
+                {"ARN": f"{arn[:-7]}:one-AbCdEf", "Name": "one", "SecretString": "1"},
+                {"ARN": arn, "Name": "two", "SecretString": "2"},
+                {"ARN": f"{arn[:-7]}:bin-AbCdEf", "Name": "bin", "SecretBinary": b""},
+            ],
+            "Errors": [
+                {"SecretId": "missing", "ErrorCode": "ResourceNotFoundException"}
+            ],
+        }
+        actual = fetch_secretsmanager_parameter_values(
+            m_boto_client, ["one", arn, "bin", "missing"]
+        )
+        m_secrets.batch_get_secret_value.assert_called_once_with(
+            SecretIdList=sorted(["one", arn, "bin", "missing"])
+        )
+        self.assertEqual({"one": "1", arn: "2"}, actual)
+
+        # botocore before 1.34 has no batch call, secrets are then fetched one by one
+        m_boto_client.return_value = mock.Mock(spec=["get_secret_value"])
+        self.assertEqual(
+            {}, fetch_secretsmanager_parameter_values(m_boto_client, ["one"])
+        )
+        m_boto_client.return_value = m_secrets
+        m_secrets.batch_get_secret_value.side_effect = ParamValidationError(
+            report="Unknown parameter"
+        )
+        self.assertEqual(
+            {}, fetch_secretsmanager_parameter_values(m_boto_client, ["one"])
+        )
@@ -5,6 +5,8 @@ from unittest import mock
 
 from taskcat._client_factory import Boto3Cache
 from taskcat._config import Config
+from taskcat._dataclasses import BaseConfig
+from taskcat._template_params import clear_availability_zone_cache
 from taskcat.exceptions import TaskCatException
 
 
@@ -268,6 +270,75 @@ class TestNewConfig(unittest.TestCase):
                         f"tcat-13725204b43e5bf5a37800c23614ee21-{region_name}",
                     )
 
+    @mock.patch("taskcat._config.Boto3Cache.account_id", return_value="123412341234")
+    @mock.patch("taskcat._config.Boto3Cache.partition", return_value="aws")
+    @mock.patch("taskcat._config.S3BucketObj.create", return_value=None)
+    @mock.patch("taskcat._client_factory.boto3", autospec=True)
+    def test_get_buckets_provisions_once(self, _, m_create, __, m_boto):
+        base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
+        base_path = Path(base_path + "data/regional_client_and_bucket").resolve()
+
+        config = Config.create(
+            args={},
+            global_config_path=base_path / ".taskcat_global_regional_bucket.yml",
+            project_config_path=base_path / "./.taskcat.yml",
+            overrides_path=base_path / "./.taskcat_overrides.yml",
+            env_vars={},
+        )
+        mock_boto_cache = Boto3Cache(_boto3=m_boto)
+        buckets = config.get_buckets(boto3_cache=mock_boto_cache)
+        distinct = {
+            bucket.name for regions in buckets.values() for bucket in regions.values()
+        }
+        self.assertEqual(len(distinct), m_create.call_count)
+
+        self.assertIs(buckets, config.get_buckets())
+        self.assertEqual(len(distinct), m_create.call_count)
+
+        config.config.tests.popitem()
+        self.assertIsNot(buckets, config.get_buckets(boto3_cache=mock_boto_cache))
+
+    @mock.patch("taskcat._config.Boto3Cache.account_id", return_value="123412341234")
+    @mock.patch("taskcat._config.Boto3Cache.partition", return_value="aws")
+    @mock.patch("taskcat._client_factory.boto3", autospec=True)
+    def test_get_regions_resolves_once(self, m_boto, _, m_account_id):
+        base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
+        base_path = Path(base_path + "data/regional_client_and_bucket").resolve()
+
+        config = Config.create(
+            args={},
+            global_config_path=base_path / ".taskcat_global.yml",
+            project_config_path=base_path / "./.taskcat.yml",
+            overrides_path=base_path / "./.taskcat_overrides.yml",
+            env_vars={},
+        )
+        mock_boto_cache = Boto3Cache(_boto3=m_boto)
+        regions = config.get_regions(boto3_cache=mock_boto_cache)
+        calls = m_account_id.call_count
+        self.assertEqual(regions, config.get_regions())
+        self.assertEqual(regions, config.get_artifact_regions())
+        self.assertEqual(calls, m_account_id.call_count)
+        for test_regions in regions.values():
+            for region in test_regions.values():
+                self.assertIs(mock_boto_cache, region._boto3_cache)
+
+        with mock.patch.object(
+            BaseConfig, "to_dict", autospec=True, side_effect=BaseConfig.to_dict
+        ) as m_to_dict:
+            config.get_regions()
+            config.get_artifact_regions()
+        # once per public call, not once per test
+        self.assertEqual(2, m_to_dict.call_count)
+
+        test_name, test = next(iter(config.config.tests.items()))
+        test.regions = test.regions[:1]
+        resolved = config.get_regions()
+        self.assertEqual(test.regions, list(resolved[test_name]))
+        self.assertIsNot(
+            regions[test_name][test.regions[0]],
+            resolved[test_name][test.regions[0]],
+        )
+
     @mock.patch("taskcat._config.Boto3Cache.account_id", return_value="123412341234")
     @mock.patch("taskcat._config.Boto3Cache.partition", return_value="aws")
     @mock.patch("taskcat._config.S3BucketObj.create", return_value=None)
@@ -298,6 +369,47 @@ class TestNewConfig(unittest.TestCase):
                     with self.subTest(region=region_name):
                         buckets[test_name][region_name].delete()
 
+    @mock.patch("taskcat._config.Boto3Cache.account_id", return_value="123412341234")
+    @mock.patch("taskcat._config.Boto3Cache.partition", return_value="aws")
+    @mock.patch("taskcat._config.S3BucketObj.create", return_value=None)
+    @mock.patch("taskcat._config.ParamGen._get_license_content_wrapper")
+    @mock.patch("taskcat._config.Boto3Cache", autospec=True)
+    def test_get_rendered_params_errors(self, m_boto, _, __, ___, ____):
+        self.addCleanup(clear_availability_zone_cache)
+        base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
+        base_path = Path(base_path + "data/regional_client_and_bucket").resolve()
+        m_boto.client.return_value = mock_client()
+        config = Config.create(
+            args={},
+            project_root=base_path,
+            global_config_path=base_path / ".taskcat_global.yml",
+            project_config_path=base_path / "./.taskcat.yml",
+            overrides_path=base_path / "./.taskcat_overrides.yml",
+            env_vars={},
+        )
+        regions = config.get_regions(boto3_cache=m_boto)
+        buckets = config.get_buckets(boto3_cache=m_boto)
+        templates = config.get_templates()
+        with mock.patch.object(
+            Config, "_render_parameters", side_effect=TaskCatException("boom")
+        ):
+            with self.assertRaises(TaskCatException):
+                config.get_rendered_parameters(buckets, regions, templates)
+
+        rendered = config.get_rendered_parameters(buckets, regions, templates)
+        for test_name, test in config.config.tests.items():
+            self.assertEqual(set(test.regions), set(rendered[test_name]))
+        again = config.get_rendered_parameters(buckets, regions, templates)
+        self.assertEqual(rendered, again)
+
+        # generated values (passwords included) must not be predictable from the
+        # taskcat-id tag on the stacks
+        config._parameter_cache.clear()
+        with mock.patch("taskcat._config.ParamGen") as m_param_gen:
+            config.get_rendered_parameters(buckets, regions, templates)
+        for call in m_param_gen.call_args_list:
+            self.assertNotIn(str(config.uid), call.args[-1].random_seed)
+
     def test_get_templates(self):
         base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
         base_path = Path(base_path + "data/regional_client_and_bucket").resolve()
@@ -1,10 +1,11 @@
 import unittest
 import uuid
 from pathlib import Path
+from unittest import mock
 
 from dataclasses_jsonschema import ValidationError
 from taskcat._config import Config
-from taskcat._dataclasses import ProjectConfig, TestObj
+from taskcat._dataclasses import BaseConfig, ProjectConfig, S3BucketObj, TestObj
 from taskcat.exceptions import TaskCatException
 
 
@@ -27,6 +28,121 @@ class TestNewConfig(unittest.TestCase):
             p = ProjectConfig(s3_object_acl=acl).to_dict(validate=True)
             self.assertEqual(p["s3_object_acl"], acl)
 
+    def test_from_sources_matches_merge(self):
+        sources = [
+            {"source": "defaults", "config": {"project": {"regions": ["us-east-1"]}}},
+            {
+                "source": "global",
+                "config": {
+                    "general": {"parameters": {"A": "global"}, "s3_bucket": "bucket"}
+                },
+            },
+            {
+                "source": "project",
+                "config": {
+                    "project": {"name": "proj"},
+                    "tests": {
+                        "one": {"template": "t.yaml", "parameters": {"B": 1}},
+                        "two": {
+                            "template": "t.yaml",
+                            "regions": ["us-west-2"],
+                            "prehooks": [{"type": "script"}],
+                        },
+                    },
+                },
+            },
+            {"source": "cli", "config": {"project": {"parameters": {"A": "cli"}}}},
+        ]
+        expected = BaseConfig.from_dict(sources[0]["config"])
+        expected.set_source(sources[0]["source"])
+        for source in sources[1:]:
+            source_config = BaseConfig.from_dict(source["config"])
+            source_config.set_source(source["source"])
+            expected = BaseConfig.merge(expected, source_config)
+
+        actual = BaseConfig.from_sources(sources)
+        self.assertEqual(expected.to_dict(), actual.to_dict())
+        self.assertEqual(expected._source, actual._source)
+        self.assertEqual("project", actual._source["tests"]["one"]["parameters"]["B"])
+
+        for invalid in [
+            {"regions": "us-east-1"},
+            {"s3_object_acl": None},
+            {"parameters": None},
+        ]:
+            with self.assertRaises(ValidationError):
+                BaseConfig.from_sources(
+                    sources + [{"source": "bad", "config": {"project": invalid}}]
+                )
+        # an empty "parameters:" key in a test loads as None
+        empty_parameters = {
+            "tests": {"one": {"template": "t.yaml", "parameters": None}}
+        }
+        with self.assertRaises(ValidationError):
+            BaseConfig.from_sources(
+                sources + [{"source": "bad", "config": empty_parameters}]
+            )
+
+
+class TestS3BucketObj(unittest.TestCase):
+    @staticmethod
+    def _bucket(s3_client, auto_generated=True):
+        return S3BucketObj(
+            name="tcat-test-bucket",
+            region="us-east-1",
+            account_id="123456789012",
+            partition="aws",
+            s3_client=s3_client,
+            sigv4=True,
+            auto_generated=auto_generated,
+            regional_buckets=False,
+            object_acl="private",
+            taskcat_id=uuid.uuid4(),
+            org_id=None,
+        )
+
+    def test_empty_deletes_each_version_page(self):
+        m_s3_client = mock.Mock()
+        pages = [
+            {
+                "Versions": [
+                    {"Key": f"key{i}", "VersionId": f"v{i}"} for i in range(1000)
+                ],
+                "DeleteMarkers": [{"Key": "key0", "VersionId": "marker"}],
+            },
+            {"Versions": [{"Key": "last", "VersionId": "null"}]},
+            {},
+        ]
+        m_s3_client.get_paginator.return_value.paginate.return_value = iter(pages)
+        m_s3_client.delete_objects.return_value = {}
+        self._bucket(m_s3_client).empty(max_in_flight=2)
+
+        m_s3_client.get_paginator.assert_called_once_with("list_object_versions")
+        batches = [
+            c[1]["Delete"]["Objects"] for c in m_s3_client.delete_objects.call_args_list
+        ]
+        self.assertEqual(3, len(batches))
+        deleted = [obj for batch in batches for obj in batch]
+        self.assertEqual(1002, len(deleted))
+        self.assertIn({"Key": "key0", "VersionId": "marker"}, deleted)
+        self.assertIn({"Key": "last", "VersionId": "null"}, deleted)
+
+    def test_empty_raises_on_delete_errors(self):
+        m_s3_client = mock.Mock()
+        m_s3_client.get_paginator.return_value.paginate.return_value = [
+            {"Versions": [{"Key": "key", "VersionId": "null"}]}
+        ]
+        m_s3_client.delete_objects.return_value = {
+            "Errors": [{"Key": "key", "Code": "AccessDenied"}]
+        }
+        with self.assertRaises(TaskCatException):
+            self._bucket(m_s3_client).empty()
+
+    def test_empty_skips_external_buckets(self):
+        m_s3_client = mock.Mock()
+        self._bucket(m_s3_client, auto_generated=False).empty()
+        m_s3_client.get_paginator.assert_not_called()
+
 
 class TestTestObj(unittest.TestCase):
     def test_stack_name(self):
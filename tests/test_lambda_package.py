@@ -1,8 +1,13 @@
+import io
+import json
 import os
+import tarfile
 import unittest
+import zipfile
 from os import mkdir
 from pathlib import Path
 from shutil import copytree
+from subprocess import CalledProcessError
 from tempfile import mkdtemp
 from unittest.mock import MagicMock, patch
 
@@ -11,7 +16,8 @@ from requests.exceptions import ReadTimeout
 import pytest
 from dulwich.repo import Repo
 from taskcat._config import Config
-from taskcat._lambda_build import LambdaBuild
+from taskcat._lambda_build import LambdaBuild, LambdaBuildOptions
+from taskcat.exceptions import TaskCatException
 
 
 def m_get_archive(path):
@@ -185,3 +191,283 @@ class TestLambdaPackage(unittest.TestCase):
         path = path / "submodules" / "DeepSub"
         self.assertEqual((path / "lambda_functions" / "packages").is_dir(), True)
         self.assertEqual((path / zip_suffix).is_file(), True)
+
+
+class TestLambdaBuildScheduler(unittest.TestCase):
+    def _project(self, packages):
+        tmp = Path(mkdtemp())
+        (tmp / ".taskcat.yml").write_text("project:\n  name: scheduler\n")
+        for name, marker in packages.items():
+            (tmp / "lambda_functions" / "source" / name).mkdir(parents=True)
+            (tmp / "lambda_functions" / "source" / name / marker).touch()
+        config = Config.create(
+            project_config_path=tmp / ".taskcat.yml",
+            project_root=tmp,
+            args={"project": {"build_submodules": False}},
+        )
+        return config, tmp
+
+    @patch("taskcat._lambda_build.docker", autospec=True)
+    @patch.object(LambdaBuild, "_docker_extract", autospec=True)
+    @patch.object(LambdaBuild, "_docker_build")
+    @patch.object(LambdaBuild, "_pip_build")
+    @patch.object(LambdaBuild, "_zip_dir")
+    def test_builds_each_package_by_kind(self, m_zip, m_pip, m_docker_build, *_):
+        config, tmp = self._project(
+            {
+                "Plain": "index.py",
+                "Pip": "requirements.txt",
+                "Docker": "Dockerfile",
+                "Other": "index.py",
+            }
+        )
+        LambdaBuild(config, project_root=tmp)
+        packages = tmp / "lambda_functions" / "packages"
+        self.assertEqual(
+            {call.args[1] for call in m_zip.call_args_list},
+            {packages / "Plain", packages / "Other"},
+        )
+        m_pip.assert_called_once()
+        self.assertEqual(m_pip.call_args.args[1], packages / "Pip")
+        m_docker_build.assert_called_once()
+
+    @patch("taskcat._lambda_build.docker", autospec=True)
+    @patch.object(LambdaBuild, "_zip_dir")
+    def test_failures(self, m_zip, _):
+        config, tmp = self._project({f"Func{i}": "index.py" for i in range(6)})
+
+        def zip_dir(build_path, _):
+            if build_path.name in ["Func1", "Func4"]:
+                raise TaskCatException(f"{build_path.name} failed")
+
+        m_zip.side_effect = zip_dir
+        with self.assertRaises(TaskCatException) as ex:
+            LambdaBuild(
+                config, project_root=tmp, options=LambdaBuildOptions(fail_fast=False)
+            )
+        self.assertEqual(str(ex.exception), "2 lambda packages failed to build")
+        self.assertEqual(m_zip.call_count, 6)
+
+        def zip_dir_once(build_path, _):
+            if build_path.name == "Func1":
+                raise TaskCatException(f"{build_path.name} failed")
+
+        m_zip.side_effect = zip_dir_once
+        with self.assertRaises(TaskCatException) as ex:
+            LambdaBuild(config, project_root=tmp)
+        self.assertEqual(str(ex.exception), "Func1 failed")
+
+    @patch("taskcat._lambda_build.docker", autospec=True)
+    def test_build_cache(self, _):
+        config, tmp = self._project({"Cached": "index.py", "Changed": "index.py"})
+        packages = tmp / "lambda_functions" / "packages"
+        LambdaBuild(config, project_root=tmp)
+        manifest = json.loads((packages / LambdaBuild.manifest_name).read_text())
+        self.assertEqual(set(manifest["packages"]), {"Cached", "Changed"})
+
+        (tmp / "lambda_functions" / "source" / "Changed" / "index.py").write_text("x")
+        with patch.object(LambdaBuild, "_zip_dir") as m_zip:
+            LambdaBuild(config, project_root=tmp)
+        m_zip.assert_called_once_with(
+            tmp / "lambda_functions" / "source" / "Changed", packages / "Changed"
+        )
+
+        (packages / "Cached" / "lambda.zip").unlink()
+        with patch.object(LambdaBuild, "_zip_dir") as m_zip:
+            LambdaBuild(config, project_root=tmp)
+        m_zip.assert_called_once_with(
+            tmp / "lambda_functions" / "source" / "Cached", packages / "Cached"
+        )
+
+        with patch.object(LambdaBuild, "_zip_dir") as m_zip:
+            LambdaBuild(
+                config, project_root=tmp, options=LambdaBuildOptions(use_cache=False)
+            )
+        self.assertEqual(m_zip.call_count, 2)
+
+    @patch("taskcat._lambda_build.docker", autospec=True)
+    def test_zip_is_reproducible(self, _):
+        config, tmp = self._project({"Func": "index.py"})
+        source = tmp / "lambda_functions" / "source" / "Func"
+        (source / "lib").mkdir()
+        (source / "lib" / "util.py").write_text("x = 1\n" * 100)
+        (source / "run.sh").write_text("#!/bin/sh\n")
+        (source / "run.sh").chmod(0o775)
+        zip_path = tmp / "lambda_functions" / "packages" / "Func" / "lambda.zip"
+
+        LambdaBuild(
+            config, project_root=tmp, options=LambdaBuildOptions(use_cache=False)
+        )
+        first = zip_path.read_bytes()
+        for path in [source / "index.py", source / "lib" / "util.py"]:
+            os.utime(path, (0, 0))
+        (source / "lib" / "util.py").chmod(0o600)
+        LambdaBuild(
+            config, project_root=tmp, options=LambdaBuildOptions(use_cache=False)
+        )
+        self.assertEqual(first, zip_path.read_bytes())
+
+        with zipfile.ZipFile(zip_path) as zip_file:
+            infos = {info.filename: info for info in zip_file.infolist()}
+            self.assertEqual(list(infos), ["index.py", "lib/", "lib/util.py", "run.sh"])
+            self.assertEqual(zip_file.read("lib/util.py"), b"x = 1\n" * 100)
+        self.assertEqual(infos["run.sh"].external_attr >> 16, 0o100755)
+        self.assertEqual(infos["lib/util.py"].external_attr >> 16, 0o100644)
+        self.assertEqual(infos["lib/util.py"].compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(infos["index.py"].date_time, LambdaBuild.ZIP_DATE_TIME)
+
+        LambdaBuild(
+            config,
+            project_root=tmp,
+            options=LambdaBuildOptions(zip_compression_level=0),
+        )
+        with zipfile.ZipFile(zip_path) as zip_file:
+            self.assertEqual(
+                zip_file.getinfo("lib/util.py").compress_type, zipfile.ZIP_STORED
+            )
+
+    @patch("taskcat._lambda_build.docker", autospec=True)
+    @patch("taskcat._lambda_build.subprocess_run", autospec=True)
+    def test_pip_build_uses_wheelhouse(self, m_run, _):
+        def pip(command, cwd, **_):
+            if command[1] == "--version":
+                return MagicMock(stdout=b"pip 1.0")
+            if command[1] == "wheel":
+                wheel_dir = Path(command[command.index("--wheel-dir") + 1])
+                (wheel_dir / "dep-1.0-py3-none-any.whl").touch()
+                return MagicMock()
+            wheelhouse = Path(command[command.index("--find-links") + 1])
+            offline = "--no-index" in command
+            if offline and not (wheelhouse / "dep-1.0-py3-none-any.whl").is_file():
+                raise CalledProcessError(1, command, stderr=b"no matching dist")
+            target = Path(command[command.index("--target") + 1])
+            (target / "dep").mkdir(parents=True)
+            (target / "dep" / "__init__.py").touch()
+            return MagicMock()
+
+        m_run.side_effect = pip
+        config, tmp = self._project({"PipOne": "requirements.txt"})
+        (tmp / "lambda_functions" / "source" / "PipTwo").mkdir()
+        (tmp / "lambda_functions" / "source" / "PipTwo" / "requirements.txt").touch()
+        cache = Path(mkdtemp())
+
+        LambdaBuild(
+            config,
+            project_root=tmp,
+            options=LambdaBuildOptions(pip_cache_path=cache, max_pip_builds=1),
+        )
+        commands = [c.args[0][1] for c in m_run.call_args_list]
+        self.assertEqual(commands.count("wheel"), 1)
+        self.assertEqual(commands.count("install"), 3)
+        self.assertEqual(
+            [p.name for p in (cache / "wheelhouse").iterdir()],
+            ["dep-1.0-py3-none-any.whl"],
+        )
+        for name in ["PipOne", "PipTwo"]:
+            source = tmp / "lambda_functions" / "source" / name
+            self.assertEqual([p.name for p in source.iterdir()], ["requirements.txt"])
+            zip_path = tmp / "lambda_functions" / "packages" / name / "lambda.zip"
+            with zipfile.ZipFile(zip_path) as zip_file:
+                self.assertEqual(
+                    zip_file.namelist(), ["dep/", "dep/__init__.py", "requirements.txt"]
+                )
+        # pip runs in a copy of the source unless asked to build in place
+        source = tmp / "lambda_functions" / "source" / "PipOne"
+        installs = [c for c in m_run.call_args_list if c.args[0][1] == "install"]
+        self.assertNotIn(source, [Path(c.kwargs["cwd"]) for c in installs])
+        m_run.reset_mock()
+        LambdaBuild(
+            config,
+            project_root=tmp,
+            options=LambdaBuildOptions(
+                pip_cache_path=cache, use_cache=False, copy_pip_source=False
+            ),
+        )
+        installs = [c for c in m_run.call_args_list if c.args[0][1] == "install"]
+        self.assertIn(source, [Path(c.kwargs["cwd"]) for c in installs])
+
+    @patch("taskcat._lambda_build.docker", autospec=True)
+    @patch("taskcat._lambda_build.subprocess_run", autospec=True)
+    def test_pip_build_local_requirement(self, m_run, _):
+        # local and VCS requirements are built from source on every install, which
+        # needs the build backend from the index, so the wheelhouse can't do it
+        def pip(command, cwd, **_):
+            if command[1] == "--version":
+                return MagicMock(stdout=b"pip 1.0")
+            if command[1] == "wheel" or "--no-index" in command:
+                raise CalledProcessError(
+                    1, command, stderr=b"No matching distribution for setuptools"
+                )
+            self.assertEqual(
+                ["./lib"], (Path(cwd) / "requirements.txt").read_text().split()
+            )
+            target = Path(command[command.index("--target") + 1])
+            (target / "mylib").mkdir(parents=True)
+            (target / "mylib" / "__init__.py").touch()
+            return MagicMock()
+
+        m_run.side_effect = pip
+        config, tmp = self._project({"Pip": "requirements.txt"})
+        source = tmp / "lambda_functions" / "source" / "Pip"
+        (source / "requirements.txt").write_text("./lib\n")
+        (source / "lib").mkdir()
+        (source / "lib" / "setup.py").touch()
+        cache = Path(mkdtemp())
+
+        LambdaBuild(
+            config, project_root=tmp, options=LambdaBuildOptions(pip_cache_path=cache)
+        )
+        installs = [
+            c.args[0] for c in m_run.call_args_list if c.args[0][1] == "install"
+        ]
+        self.assertEqual(2, len(installs))
+        self.assertIn("--no-index", installs[0])
+        self.assertNotIn("--no-index", installs[1])
+        self.assertIn(str(cache / "pip"), installs[1])
+        self.assertIn(str(cache / "wheelhouse"), installs[1])
+        zip_path = tmp / "lambda_functions" / "packages" / "Pip" / "lambda.zip"
+        with zipfile.ZipFile(zip_path) as zip_file:
+            self.assertIn("mylib/__init__.py", zip_file.namelist())
+            self.assertIn("lib/setup.py", zip_file.namelist())
+
+    @patch("taskcat._lambda_build.docker", autospec=True)
+    def test_docker_extract_streams_output(self, m_docker):
+        config, tmp = self._project({})
+        archive = (
+            Path(__file__).parent
+            / "data"
+            / "lambda_build_with_submodules"
+            / "docker_archive.tar"
+        ).read_bytes()
+        chunks = [archive[i : i + 1000] for i in range(0, len(archive), 1000)]
+        m_container = MagicMock(
+            **{
+                "logs.return_value": [b"adding: index.py\n"],
+                "wait.return_value": {"StatusCode": 0},
+                "get_archive.return_value": (chunks, None),
+            }
+        )
+        m_docker.from_env.return_value.containers.run.return_value = m_container
+        build = LambdaBuild(config, project_root=tmp)
+        cwd = set(Path.cwd().iterdir())
+
+        build._docker_extract("tag", tmp / "package")
+        self.assertEqual([p.name for p in (tmp / "package").iterdir()], ["lambda.zip"])
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            expected = tar.extractfile("output/lambda.zip").read()
+        self.assertEqual((tmp / "package" / "lambda.zip").read_bytes(), expected)
+        self.assertEqual(cwd, set(Path.cwd().iterdir()))
+        m_container.remove.assert_called_once()
+
+        evil = io.BytesIO()
+        with tarfile.open(fileobj=evil, mode="w") as tar:
+            info = tarfile.TarInfo("output/../../evil.txt")
+            tar.addfile(info, io.BytesIO())
+        m_container.get_archive.return_value = ([evil.getvalue()], None)
+        with self.assertRaises(TaskCatException):
+            build._docker_extract("tag", tmp / "package")
+        self.assertFalse((tmp / "evil.txt").exists())
+
+        m_container.wait.return_value = {"StatusCode": 1}
+        with self.assertRaises(TaskCatException):
+            build._docker_extract("tag", tmp / "package")
@@ -1,19 +1,26 @@
+import gzip
+import hashlib
+import io
+import json
 import os
+import tempfile
 import unittest
 from pathlib import Path
 from unittest import mock
 
+from botocore.exceptions import ClientError
+
 from taskcat._s3_sync import S3Sync
 
 
 class TestS3Sync(unittest.TestCase):
-    def test_init(self):
+    @mock.patch("taskcat._s3_sync.TransferManager", autospec=True)
+    def test_init(self, m_manager):
         m_s3_client = mock.Mock()
         m_s3_client.list_objects_v2.return_value = {
             "Contents": [{"Key": "test_prefix/test_object", "ETag": "test_etag"}]
         }
         m_s3_client.delete_objects.return_value = {}
-        m_s3_client.upload_file.return_value = None
         prefix = "test_prefix"
         base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
         base_path = Path(base_path + "data/").resolve()
@@ -25,4 +32,64 @@ class TestS3Sync(unittest.TestCase):
         )
         m_s3_client.list_objects_v2.assert_called_once()
         m_s3_client.delete_objects.assert_called_once()
-        m_s3_client.upload_file.assert_called()
+        m_manager.assert_called_once()
+        uploads = m_manager.return_value.__enter__.return_value.upload.call_args_list
+        self.assertTrue(uploads)
+        sizes = [os.path.getsize(c[0][0]) for c in uploads]
+        self.assertEqual(sorted(sizes, reverse=True), sizes)
+
+    def test_hash_file_matches_upload_mode(self):
+        with tempfile.NamedTemporaryFile() as file_handle:
+            file_handle.write(b"taskcat")
+            file_handle.flush()
+            md5 = hashlib.md5(b"taskcat")  # nosec
+            self.assertEqual(
+                f'"{md5.hexdigest()}"', S3Sync._hash_file(file_handle.name)
+            )
+            with mock.patch.object(S3Sync, "multipart_threshold", 1):
+                multipart_md5 = hashlib.md5(md5.digest())  # nosec
+                self.assertEqual(
+                    f'"{multipart_md5.hexdigest()}-1"',
+                    S3Sync._hash_file(file_handle.name),
+                )
+
+    @mock.patch("taskcat._s3_sync.TransferManager", autospec=True)
+    def test_manifest_replaces_listing(self, m_manager):
+        base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
+        path = str(Path(base_path + "data/lambda_build_with_submodules").resolve())
+        m_s3_client = mock.Mock()
+        m_s3_client.get_object.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+        )
+        m_s3_client.list_objects_v2.return_value = {}
+        S3Sync(m_s3_client, "test_bucket", "test_prefix", path, use_manifest=True)
+        manifest_body = m_s3_client.put_object.call_args[1]["Body"]
+
+        m_manager.reset_mock()
+        m_s3_client = mock.Mock()
+        m_s3_client.get_object.return_value = {"Body": io.BytesIO(manifest_body)}
+        S3Sync(m_s3_client, "test_bucket", "test_prefix", path, use_manifest=True)
+        m_s3_client.get_object.assert_called_once()
+        m_s3_client.list_objects_v2.assert_not_called()
+        m_manager.return_value.__enter__.return_value.upload.assert_not_called()
+        m_s3_client.put_object.assert_not_called()
+
+    @mock.patch("taskcat._s3_sync.TransferManager", autospec=True)
+    def test_manifest_missing_or_stale(self, _):
+        base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
+        path = str(Path(base_path + "data/lambda_build_with_submodules").resolve())
+        stale = {"version": S3Sync.manifest_version, "generated": 0, "objects": {}}
+        responses = [
+            ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject"),
+            {"Body": io.BytesIO(gzip.compress(json.dumps(stale).encode("utf-8")))},
+        ]
+        for response in responses:
+            m_s3_client = mock.Mock()
+            m_s3_client.get_object.side_effect = [response]
+            m_s3_client.list_objects_v2.return_value = {}
+            S3Sync(m_s3_client, "test_bucket", "test_prefix", path, use_manifest=True)
+            m_s3_client.list_objects_v2.assert_called_once()
+            put_kwargs = m_s3_client.put_object.call_args[1]
+            self.assertEqual("test_prefix/" + S3Sync.manifest_name, put_kwargs["Key"])
+            written = json.loads(gzip.decompress(put_kwargs["Body"]))
+            self.assertTrue(written["objects"])
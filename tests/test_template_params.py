@@ -2,6 +2,7 @@ import copy
 import logging
 import os
 import re
+import time
 import unittest
 from collections import namedtuple
 from io import BytesIO
@@ -9,7 +10,15 @@ from pathlib import Path
 from unittest import mock
 
 from taskcat._client_factory import Boto3Cache
-from taskcat._template_params import ParamGen
+from taskcat._template_params import (
+    PARAMETER_VALUE_CACHE_TTL,
+    ParamGen,
+    RenderContext,
+    clear_availability_zone_cache,
+    clear_parameter_value_cache,
+    prefetch_parameter_values,
+    prefill_availability_zones,
+)
 from taskcat.exceptions import TaskCatException
 
 logger = logging.getLogger("taskcat")
@@ -264,6 +273,14 @@ class TestParamGen(unittest.TestCase):
         rp_namedtup(
             test_string="$[taskcat_git_branch]", test_pattern_attribute="RE_GITBRANCH"
         ),
+        rp_namedtup(
+            test_string="prefix-$[taskcat_genuuid]",
+            test_pattern_attribute="RE_PLACEHOLDER",
+        ),
+        rp_namedtup(
+            test_string="taskcat_autobucket_prefix",
+            test_pattern_attribute="RE_PLACEHOLDER_KIND",
+        ),
     ]
 
     def test_regxfind(self):
@@ -322,6 +339,65 @@ class TestParamGen(unittest.TestCase):
             with self.subTest(test_desc):
                 self.assertEqual(first_param, second_param)
 
+    def test_get_available_azs_cached_per_account(self):
+        clear_availability_zone_cache()
+        self.addCleanup(clear_availability_zone_cache)
+        m_client = mock.Mock(return_value=MockClient())
+        m_client.return_value.describe_availability_zones = mock.Mock(
+            wraps=m_client.return_value.describe_availability_zones
+        )
+        describe = m_client.return_value.describe_availability_zones
+        class_kwargs = {
+            **self.class_kwargs,
+            "boto_client": m_client,
+            "context": RenderContext(account_id="123456789012"),
+        }
+        pg = ParamGen(**class_kwargs)
+        self.assertEqual(pg.get_available_azs(2), "us-east-1a,us-east-1b")
+        self.assertEqual(pg.get_single_az(3), "us-east-1c")
+        excluding = ParamGen(**{**class_kwargs, "az_excludes": {"use1-az6"}})
+        self.assertEqual(excluding.get_available_azs(2), "us-east-1b,us-east-1c")
+        describe.assert_called_once()
+
+        other_account = ParamGen(
+            **{**class_kwargs, "context": RenderContext(account_id="210987654321")}
+        )
+        other_account.get_available_azs(2)
+        self.assertEqual(describe.call_count, 2)
+
+    def test_prefill_availability_zones(self):
+        clear_availability_zone_cache()
+        self.addCleanup(clear_availability_zone_cache)
+        m_client = mock.Mock(return_value=MockClient())
+        regions = [
+            mock.Mock(account_id="123456789012", client=m_client) for _ in range(4)
+        ]
+        for region, name in zip(
+            regions, ["us-east-1", "us-east-1", "eu-west-1", "eu-west-2"]
+        ):
+            region.name = name
+        prefill_availability_zones(regions)
+        self.assertEqual(m_client.call_count, 3)
+        ParamGen(
+            **{
+                **self.class_kwargs,
+                "param_dict": {"AZs": "$[taskcat_genaz_2]"},
+                "boto_client": m_client,
+                "context": RenderContext(account_id="123456789012"),
+                "region": "eu-west-1",
+            }
+        )
+        self.assertEqual(m_client.call_count, 3)
+
+    def test_needs_availability_zones(self):
+        self.assertTrue(
+            ParamGen.needs_availability_zones({"A": "x", "B": ["$[taskcat_getaz_2]"]})
+        )
+        self.assertTrue(
+            ParamGen.needs_availability_zones({"A": "$[taskcat_getsingleaz_1]"})
+        )
+        self.assertFalse(ParamGen.needs_availability_zones({"A": 1, "B": "$[x]"}))
+
     def test_genaz_raises_taskcat_exception(self):
         pg = ParamGen(**self.class_kwargs)
         pg._boto_client = MockSingleAZClient
@@ -513,6 +589,44 @@ class TestParamGen(unittest.TestCase):
         }
         self.assertEqual(pg.results, expected_result)
 
+    def test_placeholder_kinds(self):
+        pg = ParamGen(**self.class_kwargs)
+        self.assertEqual(
+            pg._placeholder_kinds(
+                "$[taskcat_autobucket_prefix]/$[qs_genpass_8A]-$[taskcat_unknown]"
+            ),
+            {"autobucket_prefix", "genpass"},
+        )
+        self.assertEqual(pg._placeholder_kinds("no-placeholders-here"), set())
+
+    def test_param_transform_only_runs_present_handlers(self):
+        input_params = {
+            "Plain": "TestStack",
+            "Number": 42,
+            "Combined": "$[taskcat_project_name]-$[taskcat_current_region]-"
+            "$[taskcat_project_name]",
+        }
+        class_kwargs = copy.deepcopy(self.class_kwargs)
+        class_kwargs["param_dict"] = input_params
+        with mock.patch.object(ParamGen, "_gen_rand_str") as m_rand_str:
+            pg = ParamGen(**class_kwargs)
+        m_rand_str.assert_not_called()
+        self.assertEqual(
+            pg.results,
+            {
+                "Plain": "TestStack",
+                "Number": "42",
+                "Combined": "foobar-us-east-1-foobar",
+            },
+        )
+        self.assertEqual(pg.mutated_params, pg.results)
+
+    def test_getval_references_literal(self):
+        class_kwargs = copy.deepcopy(self.class_kwargs)
+        class_kwargs["param_dict"] = {"A": "aval", "B": "$[taskcat_getval_A]"}
+        pg = ParamGen(**class_kwargs)
+        self.assertEqual(pg.results["B"], "aval")
+
     @mock.patch("taskcat._template_params.fetch_ssm_parameter_value")
     def test_ssm_parameter_wrapper(self, m_fetch_ssm):
         m_fetch_ssm.return_value = "blah"
@@ -531,6 +645,95 @@ class TestParamGen(unittest.TestCase):
         )
         self.assertEqual(pg.param_value, "blah")
 
+    def test_random_seed_is_deterministic(self):
+        input_params = {
+            "Password": "$[taskcat_genpass_16S]",
+            "String": "$[taskcat_random-string]",
+            "Numbers": "$[taskcat_random-numbers]",
+            "List": ["$[taskcat_random-string]", "$[taskcat_random-string]"],
+        }
+        reversed_params = dict(reversed(list(input_params.items())))
+        results = [
+            ParamGen(
+                **{
+                    **self.class_kwargs,
+                    "param_dict": params,
+                    "context": RenderContext(random_seed=seed),
+                }
+            ).results
+            for params, seed in [
+                (input_params, "run:test:us-east-1"),
+                (reversed_params, "run:test:us-east-1"),
+                (input_params, "run:test:us-west-2"),
+            ]
+        ]
+        self.assertEqual(results[0], results[1])
+        self.assertNotEqual(results[0], results[2])
+        self.assertEqual(len({results[0]["String"], *results[0]["List"]}), 3)
+
+    def test_parameter_references(self):
+        self.assertEqual(
+            ParamGen.parameter_references(
+                {
+                    "A": "$[taskcat_ssm_/path/with_underscore]",
+                    "B": ["$[taskcat_secretsmanager_my-secret]", "plain"],
+                    "C": 1,
+                }
+            ),
+            ({"/path/with_underscore"}, {"my-secret"}),
+        )
+
+    @mock.patch("taskcat._template_params.fetch_secretsmanager_parameter_value")
+    @mock.patch("taskcat._template_params.fetch_ssm_parameter_value")
+    def test_prefetch_parameter_values(self, m_fetch_ssm, m_fetch_secret):
+        clear_parameter_value_cache()
+        self.addCleanup(clear_parameter_value_cache)
+        m_client = mock.Mock()
+        m_client.return_value.get_parameters.return_value = {
+            "Parameters": [{"Name": "/a", "Value": "ssm-a"}]
+        }
+        m_client.return_value.batch_get_secret_value.return_value = {
+            "SecretValues": [{"Name": "s", "ARN": "arn", "SecretString": "secret"}]
+        }
+        m_fetch_ssm.return_value = "ssm-b"
+        param_dict = {
+            "A": "$[taskcat_ssm_/a]",
+            "B": "$[taskcat_ssm_/b]",
+            "S": "$[taskcat_secretsmanager_s]",
+        }
+        region = mock.Mock(account_id="123456789012", client=m_client)
+        region.name = "us-east-1"
+        prefetch_parameter_values([(region, param_dict), (region, param_dict)])
+        m_client.return_value.get_parameters.assert_called_once_with(Names=["/a", "/b"])
+
+        for _ in range(2):
+            pg = ParamGen(
+                **{
+                    **self.class_kwargs,
+                    "param_dict": param_dict,
+                    "boto_client": m_client,
+                    "context": RenderContext(account_id="123456789012"),
+                }
+            )
+            self.assertEqual({"A": "ssm-a", "B": "ssm-b", "S": "secret"}, pg.results)
+        # only the one the batch didn't return is fetched, and only once
+        m_fetch_ssm.assert_called_once_with(m_client, "/b")
+        m_fetch_secret.assert_not_called()
+
+        # cached values expire, so rotated secrets are picked up again
+        later = time.monotonic() + PARAMETER_VALUE_CACHE_TTL + 1
+        m_fetch_secret.return_value = "rotated"
+        with mock.patch("taskcat._template_params.time.monotonic", return_value=later):
+            pg = ParamGen(
+                **{
+                    **self.class_kwargs,
+                    "param_dict": {"S": "$[taskcat_secretsmanager_s]"},
+                    "boto_client": m_client,
+                    "context": RenderContext(account_id="123456789012"),
+                }
+            )
+        self.assertEqual({"S": "rotated"}, pg.results)
+
     def test__get_project_name(self):
         input_params = {"Project_Name": "$[taskcat_project_name]"}
         bclient = MockClient
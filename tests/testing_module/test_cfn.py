@@ -62,10 +62,13 @@ class TestCFNTest(unittest.TestCase):
 
         self.assertEqual(cfn_test.printer, mock_printer, "Should use our printer.")
 
+    @patch("taskcat.testing._cfn_test.Boto3Cache", autospec=True)
     @patch("taskcat.testing._cfn_test.Stacker", autospec=True)
     @patch("taskcat.testing._cfn_test.stage_in_s3", autospec=True)
     @patch("taskcat.testing._cfn_test.LambdaBuild", autospec=True)
-    def test_run(self, mock_lambda: mm, mock_stage_s3: mm, mock_stacker: mm):
+    def test_run(
+        self, mock_lambda: mm, mock_stage_s3: mm, mock_stacker: mm, mock_boto: mm
+    ):
 
         stacker = mock_stacker.return_value
 
@@ -90,6 +93,7 @@ class TestCFNTest(unittest.TestCase):
         cfn_test.run()
 
         # Test all the mocks
+        mock_boto.return_value.prewarm.assert_called()
         mock_get_buckets.assert_called_once()
         mock_lambda.assert_called_once_with(
             cfn_test.config, cfn_test.config.project_root
@@ -99,6 +103,7 @@ class TestCFNTest(unittest.TestCase):
             cfn_test.config.config.project.name,
             cfn_test.config.project_root,
             [],
+            use_manifest=cfn_test.config.config.project.s3_sync_manifest,
         )
         mock_get_regions.assert_called_once()
         mock_get_parameters.assert_called_once_with(